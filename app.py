@@ -461,7 +461,7 @@ def list_knowledge_base_files():
     kb_path = get_knowledge_base_path()
     if not kb_path.exists():
         return []
-    supported = {".txt", ".md", ".markdown", ".pdf", ".json"}
+    supported = {".txt", ".md", ".markdown", ".pdf", ".json", ".jsonl"}
     files = []
     for f in kb_path.rglob("*"):
         if f.is_file() and f.suffix.lower() in supported:
@@ -476,6 +476,7 @@ def get_file_icon(filename):
         ".md": "MD",
         ".markdown": "MD",
         ".json": "JSON",
+        ".jsonl": "JSONL",
     }
     return icons.get(ext, "FILE")
 
@@ -517,7 +518,7 @@ with st.sidebar:
 
     uploaded_files = st.file_uploader(
         "Trascina o seleziona file",
-        type=["txt", "md", "pdf", "json"],
+        type=["txt", "md", "pdf", "json", "jsonl"],
         accept_multiple_files=True,
         label_visibility="collapsed",
     )
@@ -579,7 +580,11 @@ with st.sidebar:
             help="Sovrapposizione",
         )
 
-    clear_existing = st.checkbox("Sostituisci dati esistenti", value=True)
+    clear_existing = st.checkbox(
+        "Sostituisci dati esistenti",
+        value=False,
+        help="Se disattivato, vengono indicizzati solo i file nuovi o modificati",
+    )
 
     if st.button("Indicizza documenti", type="primary", use_container_width=True):
         if not files:
@@ -592,8 +597,12 @@ with st.sidebar:
                         chunk_size=chunk_size,
                         overlap=overlap,
                         clear_existing=clear_existing,
+                        incremental=not clear_existing,
                     )
-                    st.success(f"{result['documents']} documenti - {result['chunks']} chunks")
+                    if result["status"] == "up_to_date":
+                        st.info("Nessun documento nuovo o modificato")
+                    else:
+                        st.success(f"{result['documents']} documenti - {result['chunks']} chunks")
                 except Exception as e:
                     st.error(f"Errore: {e}")
 
@@ -609,6 +618,20 @@ with st.sidebar:
             st.metric("Chunks", stats["total_chunks"], help="Frammenti indicizzati")
         with col2:
             st.metric("Documenti", stats["total_documents"], help="File sorgente")
+
+        cache_stats = st.session_state.pipeline.get_cache_stats()
+        st.metric(
+            "Cache query",
+            f"{cache_stats['hit_rate']:.0%}",
+            help=f"{cache_stats['hits']} hit su {cache_stats['hits'] + cache_stats['embedding_hits'] + cache_stats['misses']} domande",
+        )
+
+        answer_stats = st.session_state.pipeline.get_answer_cache_stats()
+        st.metric(
+            "Cache risposte",
+            f"{answer_stats['hit_rate']:.0%}",
+            help=f"{answer_stats['hits']} risposte riusate (similarità ≥ {answer_stats['threshold']:.2f})",
+        )
     except:
         st.info("Nessun dato")
 
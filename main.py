@@ -10,6 +10,9 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+from src.embedder import EmbeddingCache
+from src.loaders import PdfTextCache
+from src.mongodb_client import MongoDBClient
 from src.rag_pipeline import RAGPipeline
 
 
@@ -21,21 +24,55 @@ def cmd_ingest(args):
 
     pipeline = RAGPipeline()
 
-    result = pipeline.ingest(
-        directory=args.directory,
-        chunk_size=args.chunk_size,
-        overlap=args.overlap,
-        clear_existing=args.clear,
-    )
+    if args.resume:
+        result = pipeline.resume(args.resume)
+    else:
+        result = pipeline.ingest(
+            directory=args.directory,
+            chunk_size=args.chunk_size,
+            overlap=args.overlap,
+            clear_existing=args.clear,
+            embedding_concurrency=args.embedding_concurrency,
+            chunk_workers=args.workers,
+            incremental=args.incremental,
+            load_workers=args.load_workers,
+            load_timeout=args.load_timeout,
+            batch_size=args.batch_size,
+        )
 
     print()
     print("Risultato:")
+    print(f"  Run: {result['run_id']}")
     print(f"  Documenti caricati: {result['documents']}")
     print(f"  Chunk creati: {result['chunks']}")
     print(f"  Chunk inseriti: {result.get('inserted', 0)}")
+    print(f"  File non caricati: {len(result['load']['failed'])}")
+    if args.incremental:
+        print(f"  File invariati: {result['unchanged']}")
+        print(f"  File rimossi: {result['removed']}")
     print(f"  Status: {result['status']}")
 
 
+def cmd_runs(args):
+    """Comando per elencare le run di indicizzazione recenti."""
+    print("=" * 50)
+    print("RUN DI INDICIZZAZIONE")
+    print("=" * 50)
+
+    runs = MongoDBClient().list_runs(limit=args.limit)
+    if not runs:
+        print("Nessuna run registrata.")
+        return
+
+    for run in runs:
+        print(
+            f"  {run['_id']}  {run['status']:<9}  {run['params']['directory']}  "
+            f"{run['chunks_stored']} chunk in {run['batches']} batch"
+        )
+        if run.get("error"):
+            print(f"    Errore: {run['error']}")
+
+
 def cmd_query(args):
     """Comando per fare domande in modalità interattiva."""
     print("=" * 50)
@@ -44,7 +81,15 @@ def cmd_query(args):
     print("Digita 'exit' o 'quit' per uscire")
     print()
 
-    pipeline = RAGPipeline()
+    pipeline = RAGPipeline(mongodb_client=MongoDBClient(index_type=args.index))
+
+    filters = {}
+    if args.source:
+        filters["source"] = args.source
+    if args.type:
+        filters["type"] = args.type
+    if args.path_prefix:
+        filters["path_prefix"] = args.path_prefix
 
     while True:
         try:
@@ -58,13 +103,23 @@ def cmd_query(args):
                 break
 
             print("\nCerco risposta...")
-            result = pipeline.query(question, k=args.top_k)
+            result = pipeline.query(
+                question,
+                k=args.top_k,
+                nprobe=args.nprobe,
+                exact=args.exact,
+                filters=filters or None,
+            )
 
             print("\n" + "-" * 40)
             print("RISPOSTA:")
             print("-" * 40)
             print(result["answer"])
 
+            if result["answer_cache"]:
+                cached = result["answer_cache"]
+                print(f"\n(risposta dalla cache: \"{cached['question']}\", similarità {cached['similarity']:.3f})")
+
             if result["sources"]:
                 print("\n" + "-" * 40)
                 print("FONTI:")
@@ -92,6 +147,68 @@ def cmd_stats(args):
     print(f"  Collection: {stats['collection']}")
     print(f"  Chunk totali: {stats['total_chunks']}")
     print(f"  Documenti sorgente: {stats['total_documents']}")
+    print(f"  Versione indice: {stats['index_version']}")
+
+
+def cmd_bench(args):
+    """Comando per misurare recall@k, latenza e memoria dell'indice vettoriale."""
+    print("=" * 50)
+    print("BENCHMARK INDICE VETTORIALE")
+    print("=" * 50)
+
+    index_params = {"quantization": args.quantization, "prefix_dim": args.prefix_dim}
+    client = MongoDBClient(index_type=args.index, index_params=index_params)
+    result = client.benchmark_index(k=args.top_k, n_queries=args.queries, nprobe=args.nprobe)
+
+    if not result:
+        print("Nessun embedding nella collection.")
+        return
+
+    print(f"  Indice: {args.index} (quantizzazione: {args.quantization}, dimensioni: {result['dim']}/{result['input_dim']})")
+    print(f"  Query: {result['queries']}")
+    print(f"  Recall@{result['k']}: {result['recall_at_k']:.3f}")
+    print(f"  Latenza media: {result['latency_ms']:.2f} ms (esatta: {result['reference_latency_ms']:.2f} ms)")
+    print(f"  Accelerazione: {result['reference_latency_ms'] / result['latency_ms']:.1f}x")
+    print(f"  Memoria vettori: {result['memory_bytes'] / 1e6:.1f} MB (float32: {result['reference_memory_bytes'] / 1e6:.1f} MB)")
+    print(f"  Riduzione memoria: {result['reference_memory_bytes'] / result['memory_bytes']:.1f}x")
+
+
+def cmd_migrate(args):
+    """Comando per convertire la codifica degli embedding salvati."""
+    print("=" * 50)
+    print("MIGRAZIONE EMBEDDING")
+    print("=" * 50)
+
+    client = MongoDBClient()
+    migrated = client.migrate_embeddings(args.encoding, batch_size=args.batch_size)
+
+    print(f"Convertiti {migrated} embedding in formato '{args.encoding}'.")
+
+
+def cmd_cache(args):
+    """Comando per ispezionare o svuotare le cache su disco."""
+    print("=" * 50)
+    print("CACHE SU DISCO")
+    print("=" * 50)
+
+    caches = {"pdf": ("Testo PDF", PdfTextCache), "embeddings": ("Embeddings", EmbeddingCache)}
+    selected = [name for name in caches if args.name in (name, "all")]
+
+    if args.action == "purge" and not args.force:
+        confirm = input(f"Svuotare le cache ({', '.join(selected)})? (s/N): ")
+        if confirm.lower() != "s":
+            print("Operazione annullata.")
+            return
+
+    for name in selected:
+        label, cache_class = caches[name]
+        cache = cache_class()
+        if args.action == "purge":
+            print(f"  {label}: eliminate {cache.clear()} voci")
+        else:
+            stats = cache.stats()
+            print(f"  {label}: {stats['entries']} voci, {stats['size_bytes'] / 2**20:.1f} MB su {stats['max_bytes'] / 2**20:.0f} MB")
+            print(f"    File: {stats['path']}")
 
 
 def cmd_clear(args):
@@ -118,8 +235,17 @@ def main():
 Esempi:
   python main.py ingest                    # Indicizza documenti da knowledge_base/
   python main.py ingest -d ./docs          # Indicizza da cartella specifica
+  python main.py ingest --incremental      # Solo file nuovi o modificati
+  python main.py ingest --resume <run>     # Riprende una run interrotta
+  python main.py runs                      # Run di indicizzazione recenti
   python main.py query                     # Modalità domande interattiva
+  python main.py query --index ivf         # Ricerca approssimata IVF
   python main.py stats                     # Mostra statistiche
+  python main.py bench --quantization int8 # Recall@k e memoria dell'indice
+  python main.py bench --prefix-dim 256    # Primo passaggio su 256 dimensioni
+  python main.py migrate --encoding binary # Embedding in float32 binario
+  python main.py cache info                # Dimensione delle cache su disco
+  python main.py cache purge --name pdf    # Svuota la cache del testo PDF
   python main.py clear                     # Pulisce il database
         """,
     )
@@ -151,8 +277,60 @@ Esempi:
         action="store_true",
         help="Elimina dati esistenti prima di indicizzare",
     )
+    parser_ingest.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Indicizza solo i file nuovi o modificati ed elimina i chunk dei file rimossi",
+    )
+    parser_ingest.add_argument(
+        "--embedding-concurrency",
+        type=int,
+        default=None,
+        help="Richieste di embedding in parallelo (default: 4)",
+    )
+    parser_ingest.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("CHUNK_WORKERS", "0")),
+        help="Thread per tokenizzazione e chunking (default: 0 = uno per core)",
+    )
+    parser_ingest.add_argument(
+        "--load-workers",
+        type=int,
+        default=int(os.getenv("LOAD_WORKERS", "0")),
+        help="Processi per il caricamento dei file (default: 0 = uno per core)",
+    )
+    parser_ingest.add_argument(
+        "--load-timeout",
+        type=float,
+        default=float(os.getenv("LOAD_TIMEOUT", "300")),
+        help="Secondi massimi per file, poi il file viene saltato (default: 300, 0 = nessun limite)",
+    )
+    parser_ingest.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.getenv("INGEST_BATCH_SIZE", "512")),
+        help="Chunk per batch di embedding e scrittura (default: 512)",
+    )
+    parser_ingest.add_argument(
+        "--resume",
+        metavar="RUN",
+        default=None,
+        help="Riprende una run interrotta con i suoi parametri, senza ricalcolare i chunk già salvati",
+    )
     parser_ingest.set_defaults(func=cmd_ingest)
 
+    # Comando runs
+    parser_runs = subparsers.add_parser("runs", help="Elenca le run di indicizzazione recenti")
+    parser_runs.add_argument(
+        "-n",
+        "--limit",
+        type=int,
+        default=10,
+        help="Numero di run da mostrare (default: 10)",
+    )
+    parser_runs.set_defaults(func=cmd_runs)
+
     # Comando query
     parser_query = subparsers.add_parser("query", help="Fai domande in modalità interattiva")
     parser_query.add_argument(
@@ -162,12 +340,123 @@ Esempi:
         default=int(os.getenv("TOP_K", "5")),
         help="Numero di chunk da recuperare (default: 5)",
     )
+    parser_query.add_argument(
+        "--index",
+        choices=["exact", "ivf"],
+        default=os.getenv("VECTOR_INDEX", "exact"),
+        help="Tipo di indice vettoriale: exact o ivf approssimato (default: exact)",
+    )
+    parser_query.add_argument(
+        "--nprobe",
+        type=int,
+        default=None,
+        help="Liste IVF esaminate per query: più alto = recall migliore (default: 8)",
+    )
+    parser_query.add_argument(
+        "--exact",
+        action="store_true",
+        help="Forza la ricerca esatta anche con indice ivf",
+    )
+    parser_query.add_argument(
+        "--source",
+        action="append",
+        help="Cerca solo nei chunk di questa fonte, inclusi i suoi record se è un file JSONL/JSON (ripetibile)",
+    )
+    parser_query.add_argument(
+        "--type",
+        action="append",
+        choices=["txt", "markdown", "pdf", "json", "jsonl"],
+        help="Cerca solo nei documenti di questo tipo (ripetibile)",
+    )
+    parser_query.add_argument(
+        "--path-prefix",
+        default=None,
+        help="Cerca solo nelle fonti il cui percorso inizia con questo prefisso",
+    )
     parser_query.set_defaults(func=cmd_query)
 
     # Comando stats
     parser_stats = subparsers.add_parser("stats", help="Mostra statistiche del database")
     parser_stats.set_defaults(func=cmd_stats)
 
+    # Comando bench
+    parser_bench = subparsers.add_parser("bench", help="Misura recall@k, latenza e memoria dell'indice")
+    parser_bench.add_argument(
+        "-k",
+        "--top-k",
+        type=int,
+        default=10,
+        help="Numero di risultati per query (default: 10)",
+    )
+    parser_bench.add_argument(
+        "--queries",
+        type=int,
+        default=100,
+        help="Numero di query di prova (default: 100)",
+    )
+    parser_bench.add_argument(
+        "--index",
+        choices=["exact", "ivf"],
+        default=os.getenv("VECTOR_INDEX", "exact"),
+        help="Tipo di indice vettoriale (default: exact)",
+    )
+    parser_bench.add_argument(
+        "--quantization",
+        choices=["none", "int8"],
+        default=os.getenv("VECTOR_QUANTIZATION", "none"),
+        help="Quantizzazione dei vettori (default: none)",
+    )
+    parser_bench.add_argument(
+        "--prefix-dim",
+        type=int,
+        default=int(os.getenv("VECTOR_PREFIX_DIM", "0")),
+        help="Dimensioni usate nel primo passaggio, con rescoring sui vettori completi (default: 0 = tutte)",
+    )
+    parser_bench.add_argument(
+        "--nprobe",
+        type=int,
+        default=None,
+        help="Liste IVF esaminate per query (default: 8)",
+    )
+    parser_bench.set_defaults(func=cmd_bench)
+
+    # Comando migrate
+    parser_migrate = subparsers.add_parser("migrate", help="Converte la codifica degli embedding salvati")
+    parser_migrate.add_argument(
+        "--encoding",
+        choices=["array", "binary"],
+        default="binary",
+        help="Codifica di destinazione: array di double o float32 binario (default: binary)",
+    )
+    parser_migrate.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Documenti aggiornati per batch (default: 1000)",
+    )
+    parser_migrate.set_defaults(func=cmd_migrate)
+
+    # Comando cache
+    parser_cache = subparsers.add_parser("cache", help="Ispeziona o svuota le cache su disco")
+    parser_cache.add_argument(
+        "action",
+        choices=["info", "purge"],
+        help="info: voci e dimensione; purge: svuota",
+    )
+    parser_cache.add_argument(
+        "--name",
+        choices=["pdf", "embeddings", "all"],
+        default="all",
+        help="Cache da considerare (default: all)",
+    )
+    parser_cache.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Non chiedere conferma prima di svuotare",
+    )
+    parser_cache.set_defaults(func=cmd_cache)
+
     # Comando clear
     parser_clear = subparsers.add_parser("clear", help="Elimina tutti i dati dal database")
     parser_clear.add_argument(
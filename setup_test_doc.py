@@ -18,13 +18,16 @@ client = MongoClient(uri, serverSelectionTimeoutMS=60000, connectTimeoutMS=60000
 db = client["rag_db"]
 collection = db["chunks"]
 
-# Documento di test con embedding finto (1536 dimensioni)
+# Dimensioni degli embedding: devono coincidere con quelle dell'indice vettoriale su Atlas
+dimensions = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or 1536
+
+# Documento di test con embedding finto
 test_doc = {
     "chunk_id": "test-setup-001",
     "text": "Questo è un documento di test per configurare l'indice vettoriale.",
     "source": "setup_test",
     "metadata": {"type": "test", "chunk_index": 0, "total_chunks": 1},
-    "embedding": [0.0] * 1536  # Vettore di 1536 zeri
+    "embedding": [0.0] * dimensions  # Vettore di zeri
 }
 
 # Inserisci documento
@@ -38,5 +41,6 @@ print("Vai su Atlas Search e usa questi valori:")
 print("  - Index Name: vector_index")
 print("  - Database: rag_db")
 print("  - Collection: chunks")
+print(f"  - Dimensioni: {dimensions}")
 
 client.close()
@@ -1,6 +1,6 @@
 from .loaders import load_directory
 from .chunker import chunk_documents
-from .embedder import Embedder
+from .embedder import Embedder, create_embedder
 from .mongodb_client import MongoDBClient
 from .rag_pipeline import RAGPipeline
 
@@ -8,6 +8,7 @@ __all__ = [
     "load_directory",
     "chunk_documents",
     "Embedder",
+    "create_embedder",
     "MongoDBClient",
     "RAGPipeline",
 ]
@@ -2,8 +2,10 @@
 Text Chunker - Suddivisione documenti in chunk con overlap
 """
 
+import hashlib
 import os
-import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
 
 import tiktoken
 
@@ -12,6 +14,12 @@ import tiktoken
 DEFAULT_CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
 DEFAULT_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
 
+# "offsets": taglia il testo originale agli offset dei token; "tokens": decodifica ogni finestra
+DEFAULT_CHUNK_MODE = os.getenv("CHUNK_MODE", "offsets")
+
+# Thread di tokenizzazione in chunk_documents (0 = uno per core)
+DEFAULT_CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "0"))
+
 
 def get_tokenizer(model: str = "cl100k_base"):
     """Ottiene il tokenizer di tiktoken."""
@@ -69,43 +77,163 @@ def chunk_text(
     return chunks
 
 
+def _char_start(data: bytes, position: int) -> int:
+    """Arretra una posizione in byte UTF-8 fino all'inizio del carattere che la contiene."""
+    while 0 < position < len(data) and data[position] & 0xC0 == 0x80:
+        position -= 1
+    return position
+
+
+def iter_chunks(
+    text: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    overlap: int = DEFAULT_OVERLAP,
+    tokenizer=None,
+) -> Iterator[str]:
+    """
+    Suddivide un testo in chunk basati sui token, tagliando la stringa originale.
+
+    Le finestre sono le stesse di chunk_text (chunk_size token, overlap token
+    in comune), ma ogni tratto tra due confini viene decodificato una sola
+    volta per ricavarne la lunghezza in byte: i chunk sono slice del testo
+    UTF-8, senza decodificare due volte le sovrapposizioni e senza spezzare
+    caratteri multibyte (un confine a metà carattere arretra all'inizio del
+    carattere). Una finestra finale già contenuta nella precedente non viene prodotta.
+
+    Args:
+        text: Il testo da suddividere
+        chunk_size: Numero massimo di token per chunk
+        overlap: Numero di token di sovrapposizione tra chunk consecutivi
+        tokenizer: Tokenizer tiktoken (opzionale)
+
+    Yields:
+        I chunk, in ordine
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap deve essere minore di chunk_size.")
+    if tokenizer is None:
+        tokenizer = get_tokenizer()
+
+    # Token come array uint32: 4 byte per token invece di un oggetto int Python ciascuno
+    tokens = tokenizer.encode_to_numpy(text)
+    n_tokens = len(tokens)
+
+    if n_tokens <= chunk_size:
+        yield text
+        return
+
+    windows = []
+    for start in range(0, n_tokens, chunk_size - overlap):
+        windows.append((start, min(start + chunk_size, n_tokens)))
+        if start + chunk_size >= n_tokens:
+            break
+
+    # Offset in byte di ogni confine di finestra (inizi e fine)
+    boundaries = sorted({position for window in windows for position in window} | {0})
+    byte_offsets = {0: 0}
+    position = 0
+    for previous, boundary in zip(boundaries, boundaries[1:]):
+        position += len(tokenizer.decode_bytes(tokens[previous:boundary].tolist()))
+        byte_offsets[boundary] = position
+
+    data = text.encode("utf-8")
+    for start, end in windows:
+        start_byte = _char_start(data, byte_offsets[start])
+        end_byte = _char_start(data, byte_offsets[end])
+        yield data[start_byte:end_byte].decode("utf-8")
+
+
+def make_chunk_id(source: str, chunk_index: int, text: str) -> str:
+    """chunk_id deterministico: hash di fonte, posizione nel documento e contenuto."""
+    return hashlib.sha256(f"{source}\0{chunk_index}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def _splitter(mode: str):
+    """Funzione di suddivisione per la modalità di chunking."""
+    if mode not in ("offsets", "tokens"):
+        raise ValueError(f"Modalità di chunking non supportata: {mode}")
+    return iter_chunks if mode == "offsets" else chunk_text
+
+
+def _chunk_document(doc: dict, split, chunk_size: int, overlap: int, tokenizer) -> list[dict]:
+    """Suddivide un singolo documento nei chunk con i relativi metadati."""
+    text_chunks = list(split(doc["content"], chunk_size, overlap, tokenizer))
+
+    return [
+        {
+            "chunk_id": make_chunk_id(doc["source"], i, chunk_text_content),
+            "text": chunk_text_content,
+            "source": doc["source"],
+            "metadata": {
+                "type": doc["type"],
+                # File di origine: per i record di un file JSONL/array JSON la fonte è "percorso#riga"
+                "path": doc.get("path", doc["source"]),
+                "chunk_index": i,
+                "total_chunks": len(text_chunks),
+            },
+        }
+        for i, chunk_text_content in enumerate(text_chunks)
+    ]
+
+
+def chunk_document(
+    doc: dict,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    overlap: int = DEFAULT_OVERLAP,
+    mode: str = DEFAULT_CHUNK_MODE,
+    tokenizer=None,
+) -> list[dict]:
+    """
+    Suddivide un singolo documento in chunk (come chunk_documents, per l'elaborazione in streaming).
+
+    Args:
+        doc: Documento con campi 'content', 'source', 'type'
+        chunk_size: Numero massimo di token per chunk
+        overlap: Numero di token di sovrapposizione
+        mode: "offsets" oppure "tokens"
+        tokenizer: Tokenizer tiktoken (opzionale)
+
+    Returns:
+        Lista di chunk con campi 'chunk_id', 'text', 'source', 'metadata'
+    """
+    return _chunk_document(doc, _splitter(mode), chunk_size, overlap, tokenizer or get_tokenizer())
+
+
 def chunk_documents(
     documents: list[dict],
     chunk_size: int = DEFAULT_CHUNK_SIZE,
     overlap: int = DEFAULT_OVERLAP,
+    mode: str = DEFAULT_CHUNK_MODE,
+    workers: int = DEFAULT_CHUNK_WORKERS,
 ) -> list[dict]:
     """
     Processa una lista di documenti e li suddivide in chunk.
 
+    Con workers > 1 i documenti sono tokenizzati in parallelo su più thread
+    (tiktoken rilascia il GIL durante la codifica, come in encode_batch);
+    l'ordine dei chunk in uscita è sempre quello dei documenti.
+
     Args:
         documents: Lista di documenti con campi 'content', 'source', 'type'
         chunk_size: Numero massimo di token per chunk
         overlap: Numero di token di sovrapposizione
+        mode: "offsets" (slice del testo originale) oppure "tokens" (decodifica delle finestre)
+        workers: Thread di tokenizzazione (0 = uno per core)
 
     Returns:
         Lista di chunk con campi 'chunk_id', 'text', 'source', 'metadata'
     """
+    split = _splitter(mode)
     tokenizer = get_tokenizer()
-    all_chunks = []
-
-    for doc in documents:
-        content = doc["content"]
-        source = doc["source"]
-        doc_type = doc["type"]
-
-        text_chunks = chunk_text(content, chunk_size, overlap, tokenizer)
-
-        for i, chunk_text_content in enumerate(text_chunks):
-            chunk = {
-                "chunk_id": str(uuid.uuid4()),
-                "text": chunk_text_content,
-                "source": source,
-                "metadata": {
-                    "type": doc_type,
-                    "chunk_index": i,
-                    "total_chunks": len(text_chunks),
-                },
-            }
-            all_chunks.append(chunk)
-
-    return all_chunks
+    workers = min(workers or os.cpu_count() or 1, len(documents))
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            per_document = list(executor.map(
+                lambda doc: _chunk_document(doc, split, chunk_size, overlap, tokenizer),
+                documents,
+            ))
+    else:
+        per_document = [_chunk_document(doc, split, chunk_size, overlap, tokenizer) for doc in documents]
+
+    return [chunk for chunks in per_document for chunk in chunks]
@@ -0,0 +1,171 @@
+"""
+Disk Cache - Cache persistente chiave → blob su SQLite
+Dimensione massima in byte con eviction LRU e contatori hit/miss
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+
+DEFAULT_CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+# Dopo un'eviction la cache scende a questa frazione della dimensione massima
+_EVICTION_TARGET = 0.9
+
+# Chiavi per singola query SQL (limite delle variabili di SQLite)
+_SQL_BATCH_SIZE = 500
+
+
+class DiskCache:
+    """Cache chiave → bytes persistente su file SQLite, con eviction LRU per dimensione."""
+
+    def __init__(self, path: str, max_bytes: int):
+        """
+        Apre (o crea) la cache.
+
+        Args:
+            path: Percorso del file SQLite
+            max_bytes: Dimensione massima dei valori memorizzati
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._conn.commit()
+
+        # Dimensione stimata, ricalcolata esattamente solo quando supera il limite
+        self._size = self._total_size()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Restituisce il valore associato alla chiave, oppure None."""
+        return self.get_many([key]).get(key)
+
+    def put(self, key: str, value: bytes):
+        """Memorizza un valore."""
+        self.put_many({key: value})
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, bytes]:
+        """
+        Legge più chiavi in una volta e ne aggiorna l'ultimo accesso.
+
+        Args:
+            keys: Chiavi da leggere
+
+        Returns:
+            Dizionario con le sole chiavi presenti in cache
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = keys[start : start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+
+                hit_keys = [row[0] for row in rows]
+                if hit_keys:
+                    self._conn.execute(
+                        f"UPDATE entries SET last_access = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                        [time.time(), *hit_keys],
+                    )
+            self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def put_many(self, items: dict[str, bytes]):
+        """Memorizza più valori e, se necessario, libera spazio eliminando i meno usati."""
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                [(key, value, len(value), now) for key, value in items.items()],
+            )
+            self._conn.commit()
+
+            self._size += sum(len(value) for value in items.values())
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def stats(self) -> dict:
+        """Restituisce numero di voci, dimensione e contatori hit/miss."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self) -> int:
+        """Svuota la cache e restituisce il numero di voci eliminate."""
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM entries").rowcount
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+            self._size = 0
+        return deleted
+
+    def close(self):
+        """Chiude il file della cache."""
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self):
+        """Elimina le voci usate meno di recente finché la cache non rientra nel limite."""
+        total = self._total_size()
+        self._size = total
+        if total <= self.max_bytes:
+            return
+
+        to_free = total - int(self.max_bytes * _EVICTION_TARGET)
+        victims = []
+        freed = 0
+        cursor = self._conn.execute("SELECT key, size FROM entries ORDER BY last_access")
+        while freed < to_free:
+            rows = cursor.fetchmany(_SQL_BATCH_SIZE)
+            if not rows:
+                break
+            for key, size in rows:
+                victims.append((key,))
+                freed += size
+                if freed >= to_free:
+                    break
+        cursor.close()
+
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self._conn.commit()
+        self._size = total - freed
+
+    def _total_size(self) -> int:
+        """Somma esatta delle dimensioni dei valori memorizzati."""
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
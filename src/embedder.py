@@ -2,22 +2,323 @@
 Embedder - Generazione embeddings via OpenAI API
 """
 
+import hashlib
 import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Optional
 
-from openai import OpenAI
+import numpy as np
+from openai import APIConnectionError, APIStatusError, APITimeoutError, OpenAI, RateLimitError
+
+from .chunker import get_tokenizer
+from .disk_cache import DEFAULT_CACHE_DIR, DiskCache
 
 
 DEFAULT_EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
 
+# Valore di EMBEDDING_MODEL che seleziona il backend locale (nessuna chiamata di rete)
+LOCAL_EMBEDDING_MODEL = "local"
+DEFAULT_EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+DEFAULT_EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "true").lower() in ("1", "true", "yes")
+DEFAULT_EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+DEFAULT_EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+DEFAULT_EMBEDDING_RPM = int(os.getenv("EMBEDDING_RPM", "3000"))
+DEFAULT_EMBEDDING_TPM = int(os.getenv("EMBEDDING_TPM", "1000000"))
+DEFAULT_EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+DEFAULT_BATCH_ITEMS = int(os.getenv("EMBEDDING_BATCH_ITEMS", "512"))
+DEFAULT_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+
+# Token massimi per singolo input dei modelli text-embedding-3 (oltre si tronca)
+MAX_INPUT_TOKENS = 8191
+
+# Testi tokenizzati per chiamata a encode_ordinary_batch
+_TOKENIZE_GROUP = 1000
+
+# Backoff esponenziale con jitter tra i tentativi (secondi)
+_BACKOFF_BASE = 1.0
+_BACKOFF_MAX = 60.0
+
+
+def normalize_text(text: str) -> str:
+    """Normalizza il testo come viene inviato all'API di embedding."""
+    return text.replace("\n", " ").strip()
+
+
+def pack_batches(token_counts: list[int], max_tokens: int, max_items: int) -> list[list[int]]:
+    """
+    Raggruppa gli input (in ordine) in batch con al massimo max_tokens token e max_items elementi.
+
+    Args:
+        token_counts: Token di ciascun input
+        max_tokens: Token massimi per richiesta
+        max_items: Input massimi per richiesta
+
+    Returns:
+        Lista di batch, ciascuno come lista di indici degli input
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+
+    for i, n_tokens in enumerate(token_counts):
+        if current and (current_tokens + n_tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += n_tokens
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _distribution(values: list[int]) -> dict:
+    """Minimo, media e massimo di una lista di valori."""
+    if not values:
+        return {"min": 0, "mean": 0.0, "max": 0}
+    return {"min": min(values), "mean": sum(values) / len(values), "max": max(values)}
+
+
+def merge_batch_stats(stats: list[dict]) -> Optional[dict]:
+    """Combina le statistiche di più chiamate (last_batch_stats) in un unico riepilogo."""
+    stats = [s for s in stats if s and s["batches"]]
+    if not stats:
+        return None
+
+    batches = sum(s["batches"] for s in stats)
+
+    def merge(field: str) -> dict:
+        return {
+            "min": min(s[field]["min"] for s in stats),
+            "mean": sum(s[field]["mean"] * s["batches"] for s in stats) / batches,
+            "max": max(s[field]["max"] for s in stats),
+        }
+
+    return {
+        "batches": batches,
+        "items": merge("items"),
+        "tokens": merge("tokens"),
+        "truncated": sum(s["truncated"] for s in stats),
+    }
+
+
+class RateLimiter:
+    """Budget di richieste e token al minuto condiviso tra thread (token bucket)."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        """
+        Inizializza il limitatore con i budget pieni.
+
+        Args:
+            requests_per_minute: Richieste al minuto consentite
+            tokens_per_minute: Token al minuto consentiti
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        """Attende finché la richiesta (con i suoi token) rientra nel budget, poi lo consuma."""
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests) * 60 / self.requests_per_minute,
+                    (tokens - self._tokens) * 60 / self.tokens_per_minute,
+                )
+            time.sleep(max(wait, 0.01))
+
+    def _refill(self):
+        """Ricarica i budget in proporzione al tempo trascorso."""
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """True per errori temporanei: rate limit (429), errori server (5xx), timeout e rete."""
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Attesa prima del prossimo tentativo: Retry-After se presente, altrimenti backoff con jitter."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return random.uniform(0, min(_BACKOFF_MAX, _BACKOFF_BASE * 2**attempt))
+
+
+class EmbeddingCache:
+    """Cache persistente degli embedding, indirizzata per hash di modello + testo normalizzato."""
+
+    def __init__(self, path: Optional[str] = None, max_mb: int = DEFAULT_EMBEDDING_CACHE_MAX_MB):
+        """
+        Apre la cache degli embedding.
+
+        Args:
+            path: File SQLite della cache (default: CACHE_DIR/embeddings.sqlite)
+            max_mb: Dimensione massima in MB (eviction LRU oltre il limite)
+        """
+        path = path or str(Path(DEFAULT_CACHE_DIR) / "embeddings.sqlite")
+        self.store = DiskCache(path, max_bytes=max_mb * 1024 * 1024)
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        """Chiave di cache per un testo già normalizzato."""
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: list[str]) -> dict[str, list[float]]:
+        """Restituisce gli embedding in cache, indicizzati per testo."""
+        keys = {self.key(model, text): text for text in texts}
+        found = self.store.get_many(keys)
+        return {keys[key]: np.frombuffer(value, dtype="<f4").tolist() for key, value in found.items()}
+
+    def put_many(self, model: str, embeddings: dict[str, list[float]]):
+        """Memorizza gli embedding (float32) indicizzati per testo."""
+        self.store.put_many({
+            self.key(model, text): np.asarray(embedding, dtype="<f4").tobytes()
+            for text, embedding in embeddings.items()
+        })
+
+    def stats(self) -> dict:
+        """Statistiche della cache (voci, dimensione, hit/miss)."""
+        return self.store.stats()
+
+    def clear(self) -> int:
+        """Svuota la cache e restituisce il numero di voci eliminate."""
+        return self.store.clear()
+
+
+class BaseEmbedder(ABC):
+    """Interfaccia comune dei backend di embedding (API OpenAI o modello locale)."""
+
+    model: str = ""
+    last_batch_stats: Optional[dict] = None
+
+    # Richieste di embedding in volo contemporaneamente (1 per i backend locali)
+    max_concurrency: int = 1
+
+    # Chunk massimi passati a fit, campionati dal corpus (0 = tutti)
+    fit_chunks: int = 0
+
+    def get_embedding(self, text: str) -> list[float]:
+        """Genera l'embedding per un singolo testo."""
+        return self.get_embeddings_batch([text])[0]
+
+    @abstractmethod
+    def get_embeddings_batch(
+        self,
+        texts: list[str],
+        batch_size: int = DEFAULT_BATCH_ITEMS,
+        max_concurrency: Optional[int] = None,
+        stats: Optional[dict] = None,
+    ) -> list[list[float]]:
+        """Genera embeddings per una lista di testi, nello stesso ordine (stats: vedi embed_chunks)."""
+
+    def cache_stats(self) -> Optional[dict]:
+        """Statistiche della cache degli embedding (None se il backend non ne usa una)."""
+        return None
+
+    @property
+    def fitted(self) -> bool:
+        """False se il backend va adattato al corpus (fit) prima di generare embeddings."""
+        return True
+
+    def fit(self, texts: list[str]):
+        """Adatta il backend a un corpus (nessuna operazione per i modelli pre-addestrati)."""
+
+    def reset_model(self):
+        """Scarta lo stato adattato al corpus, se il backend ne ha uno (chiamato quando la collection viene svuotata)."""
+
+    @property
+    def model_version(self) -> str:
+        """Identifica lo spazio degli embedding: cambia quando il modello viene riadattato."""
+        return self.model
+
+    def embed_chunks(
+        self,
+        chunks: list[dict],
+        batch_size: int = DEFAULT_BATCH_ITEMS,
+        max_concurrency: Optional[int] = None,
+        stats: Optional[dict] = None,
+    ) -> list[dict]:
+        """
+        Aggiunge l'embedding a ogni chunk.
+
+        Args:
+            chunks: Lista di chunk con campo 'text'
+            batch_size: Numero massimo di testi per richiesta
+            max_concurrency: Richieste in volo (default: del backend)
+            stats: Se indicato, viene riempito con la distribuzione dei batch di
+                questa chiamata (come last_batch_stats, ma sicuro tra thread)
+
+        Returns:
+            Lista di chunk con campo 'embedding' aggiunto
+        """
+        texts = [chunk["text"] for chunk in chunks]
+        embeddings = self.get_embeddings_batch(texts, batch_size, max_concurrency, stats=stats)
+
+        for chunk, embedding in zip(chunks, embeddings):
+            chunk["embedding"] = embedding
+
+        return chunks
+
+
+def create_embedder(model: str = DEFAULT_EMBEDDING_MODEL, **kwargs) -> BaseEmbedder:
+    """
+    Crea il backend di embedding indicato da EMBEDDING_MODEL.
+
+    Args:
+        model: "local" per il modello locale su CPU, altrimenti un modello OpenAI
+        **kwargs: Parametri specifici del backend
 
-class Embedder:
+    Returns:
+        Istanza di LocalEmbedder o Embedder
+    """
+    if model == LOCAL_EMBEDDING_MODEL:
+        from .local_embedder import LocalEmbedder
+
+        return LocalEmbedder(**kwargs)
+    return Embedder(model=model, **kwargs)
+
+
+class Embedder(BaseEmbedder):
     """Classe per generare embeddings usando l'API OpenAI."""
 
     def __init__(
         self,
         api_key: Optional[str] = None,
         model: str = DEFAULT_EMBEDDING_MODEL,
+        dimensions: int = DEFAULT_EMBEDDING_DIMENSIONS,
+        use_cache: bool = DEFAULT_EMBEDDING_CACHE,
+        cache_path: Optional[str] = None,
+        max_concurrency: int = DEFAULT_EMBEDDING_CONCURRENCY,
+        requests_per_minute: int = DEFAULT_EMBEDDING_RPM,
+        tokens_per_minute: int = DEFAULT_EMBEDDING_TPM,
+        max_retries: int = DEFAULT_EMBEDDING_MAX_RETRIES,
+        max_batch_tokens: int = DEFAULT_BATCH_TOKENS,
     ):
         """
         Inizializza l'Embedder.
@@ -25,13 +326,35 @@ class Embedder:
         Args:
             api_key: OpenAI API key (default: da variabile ambiente)
             model: Modello di embedding da usare
+            dimensions: Dimensioni richieste al modello (0 = predefinite; solo text-embedding-3)
+            use_cache: Se True, riusa gli embedding già calcolati (cache su disco)
+            cache_path: File della cache (default: CACHE_DIR/embeddings.sqlite)
+            max_concurrency: Richieste di embedding in volo contemporaneamente
+            requests_per_minute: Budget di richieste al minuto
+            tokens_per_minute: Budget di token al minuto
+            max_retries: Tentativi ripetuti su 429/5xx/errori di rete
+            max_batch_tokens: Token massimi per richiesta di embedding
         """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY non trovata. Imposta la variabile ambiente o passa api_key.")
 
-        self.client = OpenAI(api_key=self.api_key)
+        # I retry sono gestiti da _create_embeddings, con backoff e rate limit condivisi
+        self.client = OpenAI(api_key=self.api_key, max_retries=0)
         self.model = model
+        self.dimensions = dimensions
+
+        # Gli embedding ridotti sono diversi da quelli completi: chiavi di cache separate
+        self.cache_namespace = f"{model}/{dimensions}" if dimensions else model
+        self.cache = EmbeddingCache(cache_path) if use_cache else None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_batch_tokens = max_batch_tokens
+        self.tokenizer = get_tokenizer()
+
+        # Distribuzione dei batch dell'ultima chiamata a get_embeddings_batch
+        self.last_batch_stats: Optional[dict] = None
 
     def get_embedding(self, text: str) -> list[float]:
         """
@@ -41,59 +364,131 @@ class Embedder:
             text: Il testo da convertire in embedding
 
         Returns:
-            Lista di float rappresentanti l'embedding (1536 dimensioni)
+            Lista di float rappresentanti l'embedding (1536 dimensioni, o self.dimensions)
         """
-        text = text.replace("\n", " ").strip()
-
-        response = self.client.embeddings.create(
-            input=text,
-            model=self.model,
-        )
-
-        return response.data[0].embedding
+        text = normalize_text(text)
+        tokens = self.tokenizer.encode_ordinary(text)
+        text_input, n_tokens = self._fit_input(text, tokens)
+        return self._create_embeddings([text_input], n_tokens)[0]
 
-    def get_embeddings_batch(self, texts: list[str], batch_size: int = 100) -> list[list[float]]:
+    def get_embeddings_batch(
+        self,
+        texts: list[str],
+        batch_size: int = DEFAULT_BATCH_ITEMS,
+        max_concurrency: Optional[int] = None,
+        stats: Optional[dict] = None,
+    ) -> list[list[float]]:
         """
         Genera embeddings per una lista di testi in batch.
 
+        I testi già presenti nella cache non vengono inviati all'API; i testi
+        duplicati vengono inviati una sola volta. I batch sono composti in base
+        ai token (al massimo max_batch_tokens token e batch_size testi per
+        richiesta); gli input oltre MAX_INPUT_TOKENS vengono troncati. I batch
+        sono inviati in parallelo (fino a max_concurrency richieste in volo) e
+        l'ordine dell'output corrisponde sempre a quello dei testi.
+
         Args:
             texts: Lista di testi
-            batch_size: Numero di testi per batch (max 2048)
+            batch_size: Numero massimo di testi per batch (max 2048)
+            max_concurrency: Richieste in volo (default: self.max_concurrency)
+            stats: Se indicato, viene riempito con la distribuzione dei batch (vedi last_batch_stats)
 
         Returns:
             Lista di embeddings
         """
-        all_embeddings = []
-
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i : i + batch_size]
-            batch = [t.replace("\n", " ").strip() for t in batch]
+        texts = [normalize_text(t) for t in texts]
+        embeddings = self.cache.get_many(self.cache_namespace, texts) if self.cache else {}
 
-            response = self.client.embeddings.create(
-                input=batch,
-                model=self.model,
-            )
+        missing = [t for t in dict.fromkeys(texts) if t not in embeddings]
+        batches, batch_stats = self._pack(missing, batch_size)
+        self.last_batch_stats = batch_stats
+        if stats is not None:
+            stats.update(batch_stats)
 
-            batch_embeddings = [item.embedding for item in response.data]
-            all_embeddings.extend(batch_embeddings)
+        workers = min(max_concurrency or self.max_concurrency, len(batches))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for batch_embeddings in executor.map(self._embed_batch, batches):
+                    embeddings.update(batch_embeddings)
+        else:
+            for batch in batches:
+                embeddings.update(self._embed_batch(batch))
 
-        return all_embeddings
+        return [embeddings[t] for t in texts]
 
-    def embed_chunks(self, chunks: list[dict], batch_size: int = 100) -> list[dict]:
+    def _pack(self, texts: list[str], max_items: int) -> tuple[list[dict], dict]:
         """
-        Aggiunge l'embedding a ogni chunk.
-
-        Args:
-            chunks: Lista di chunk con campo 'text'
-            batch_size: Dimensione del batch per le API
+        Tokenizza i testi, tronca quelli troppo lunghi e li raggruppa in batch per token.
 
         Returns:
-            Lista di chunk con campo 'embedding' aggiunto
+            Batch come dizionari con 'texts' (chiavi originali), 'inputs' (testi
+            inviati all'API) e 'tokens' (token totali della richiesta), e la
+            distribuzione dei batch
         """
-        texts = [chunk["text"] for chunk in chunks]
-        embeddings = self.get_embeddings_batch(texts, batch_size)
+        inputs = []
+        token_counts = []
+        truncated = 0
 
-        for chunk, embedding in zip(chunks, embeddings):
-            chunk["embedding"] = embedding
+        for start in range(0, len(texts), _TOKENIZE_GROUP):
+            group = texts[start : start + _TOKENIZE_GROUP]
+            for text, tokens in zip(group, self.tokenizer.encode_ordinary_batch(group)):
+                text_input, n_tokens = self._fit_input(text, tokens)
+                truncated += text_input is not text
+                inputs.append(text_input)
+                token_counts.append(n_tokens)
 
-        return chunks
+        batches = []
+        for indices in pack_batches(token_counts, self.max_batch_tokens, max_items):
+            batches.append({
+                "texts": [texts[i] for i in indices],
+                "inputs": [inputs[i] for i in indices],
+                "tokens": sum(token_counts[i] for i in indices),
+            })
+
+        stats = {
+            "batches": len(batches),
+            "items": _distribution([len(b["texts"]) for b in batches]),
+            "tokens": _distribution([b["tokens"] for b in batches]),
+            "truncated": truncated,
+        }
+        return batches, stats
+
+    def _fit_input(self, text: str, tokens: list[int]) -> tuple[str, int]:
+        """Tronca un input oltre MAX_INPUT_TOKENS; restituisce (testo da inviare, token)."""
+        if len(tokens) <= MAX_INPUT_TOKENS:
+            return text, len(tokens)
+        return self.tokenizer.decode(tokens[:MAX_INPUT_TOKENS]), MAX_INPUT_TOKENS
+
+    def _embed_batch(self, batch: dict) -> dict[str, list[float]]:
+        """Embedding di un batch di testi normalizzati, salvati anche in cache."""
+        batch_embeddings = dict(zip(batch["texts"], self._create_embeddings(batch["inputs"], batch["tokens"])))
+        if self.cache:
+            self.cache.put_many(self.cache_namespace, batch_embeddings)
+        return batch_embeddings
+
+    def _create_embeddings(self, inputs: list[str], n_tokens: int) -> list[list[float]]:
+        """
+        Chiama l'API embeddings rispettando il rate limit e ripetendo la
+        richiesta con backoff esponenziale (jitter) su errori temporanei.
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(n_tokens)
+            try:
+                extra = {"dimensions": self.dimensions} if self.dimensions else {}
+                response = self.client.embeddings.create(
+                    input=inputs,
+                    model=self.model,
+                    **extra,
+                )
+                return [item.embedding for item in response.data]
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                time.sleep(_retry_delay(e, attempt))
+                attempt += 1
+
+    def cache_stats(self) -> Optional[dict]:
+        """Statistiche della cache degli embedding (None se disattivata)."""
+        return self.cache.stats() if self.cache else None
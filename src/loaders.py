@@ -2,13 +2,47 @@
 Document Loaders - Caricamento documenti da vari formati
 """
 
+import hashlib
 import json
+import multiprocessing
 import os
+import queue
+import re
+import time
+import zlib
+from collections import deque
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
+import PyPDF2
 from PyPDF2 import PdfReader
 
+from .disk_cache import DEFAULT_CACHE_DIR, DiskCache
+
+
+SUPPORTED_EXTENSIONS = {".txt", ".md", ".markdown", ".pdf", ".json", ".jsonl"}
+
+# Processi di caricamento in parallelo (0 = uno per core, 1 = nel processo corrente)
+DEFAULT_LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", "0"))
+
+# Secondi massimi per file (0 = nessun limite); un file oltre il limite viene saltato
+DEFAULT_LOAD_TIMEOUT = float(os.getenv("LOAD_TIMEOUT", "300"))
+
+# Soglia in secondi oltre la quale un file compare tra i lenti nel riepilogo
+DEFAULT_SLOW_LOAD_SECONDS = float(os.getenv("LOAD_SLOW_SECONDS", "10"))
+
+# Cache del testo estratto dai PDF, indirizzata per hash del file
+DEFAULT_PDF_CACHE = os.getenv("PDF_CACHE", "true").lower() in ("1", "true", "yes")
+DEFAULT_PDF_CACHE_MAX_MB = int(os.getenv("PDF_CACHE_MAX_MB", "512"))
+
+# Versione dell'estrazione: va incrementata se cambia il modo in cui si ricava il testo delle pagine
+_PDF_EXTRACTOR = f"pypdf2-{PyPDF2.__version__}-1"
+
+# Caratteri letti alla volta dagli array JSON in streaming
+_READ_SIZE = 1 << 20
+
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+
 
 def load_txt(path: str) -> dict:
     """Carica un file di testo."""
@@ -32,15 +66,77 @@ def load_markdown(path: str) -> dict:
     }
 
 
+class PdfTextCache:
+    """Cache persistente del testo estratto dai PDF, pagina per pagina, indirizzata per hash del file."""
+
+    def __init__(self, path: Optional[str] = None, max_mb: int = DEFAULT_PDF_CACHE_MAX_MB):
+        """
+        Apre la cache del testo dei PDF.
+
+        Args:
+            path: File SQLite della cache (default: CACHE_DIR/pdf_text.sqlite)
+            max_mb: Dimensione massima in MB (eviction LRU oltre il limite)
+        """
+        path = path or str(Path(DEFAULT_CACHE_DIR) / "pdf_text.sqlite")
+        self.store = DiskCache(path, max_bytes=max_mb * 1024 * 1024)
+
+    @staticmethod
+    def key(content_hash: str) -> str:
+        """Chiave di cache: hash del contenuto del file e versione dell'estrattore."""
+        return f"{_PDF_EXTRACTOR}:{content_hash}"
+
+    def get(self, content_hash: str) -> Optional[list[str]]:
+        """Restituisce il testo delle pagine di un PDF già estratto, oppure None."""
+        value = self.store.get(self.key(content_hash))
+        if value is None:
+            return None
+        return json.loads(zlib.decompress(value))
+
+    def put(self, content_hash: str, pages: list[str]):
+        """Memorizza il testo delle pagine (JSON compresso)."""
+        self.store.put(self.key(content_hash), zlib.compress(json.dumps(pages).encode("utf-8")))
+
+    def stats(self) -> dict:
+        """Statistiche della cache (voci, dimensione, hit/miss)."""
+        return self.store.stats()
+
+    def clear(self) -> int:
+        """Svuota la cache e restituisce il numero di voci eliminate."""
+        return self.store.clear()
+
+
+_pdf_cache: Optional[PdfTextCache] = None
+_pdf_cache_pid: Optional[int] = None
+
+
+def get_pdf_cache() -> PdfTextCache:
+    """
+    Cache del testo dei PDF del processo corrente.
+
+    Ogni processo (anche i worker del pool di caricamento) apre la propria
+    connessione SQLite: una connessione ereditata con fork non va riusata.
+    """
+    global _pdf_cache, _pdf_cache_pid
+    if _pdf_cache is None or _pdf_cache_pid != os.getpid():
+        _pdf_cache, _pdf_cache_pid = PdfTextCache(), os.getpid()
+    return _pdf_cache
+
+
 def load_pdf(path: str) -> dict:
-    """Estrae il testo da un file PDF."""
-    reader = PdfReader(path)
-    text_parts = []
-    for page in reader.pages:
-        text = page.extract_text()
-        if text:
-            text_parts.append(text)
-    content = "\n\n".join(text_parts)
+    """Estrae il testo da un file PDF, riusando il testo in cache se il file non è cambiato."""
+    cache = get_pdf_cache() if DEFAULT_PDF_CACHE else None
+    pages = None
+    if cache:
+        content_hash = file_fingerprint(path, content_hash=True)["sha256"]
+        pages = cache.get(content_hash)
+
+    if pages is None:
+        reader = PdfReader(path)
+        pages = [page.extract_text() or "" for page in reader.pages]
+        if cache:
+            cache.put(content_hash, pages)
+
+    content = "\n\n".join(text for text in pages if text)
     return {
         "content": content,
         "source": path,
@@ -59,13 +155,7 @@ def load_json(path: str) -> dict:
     if isinstance(data, dict):
         content = data.get("content") or data.get("text") or json.dumps(data, indent=2)
     elif isinstance(data, list):
-        parts = []
-        for item in data:
-            if isinstance(item, dict):
-                parts.append(item.get("content") or item.get("text") or json.dumps(item))
-            else:
-                parts.append(str(item))
-        content = "\n\n".join(parts)
+        content = "\n\n".join(_record_text(item) for item in data)
     else:
         content = str(data)
 
@@ -76,23 +166,145 @@ def load_json(path: str) -> dict:
     }
 
 
+def _record_text(item) -> str:
+    """Testo di un record JSON: campo 'content' o 'text', altrimenti il record serializzato."""
+    if isinstance(item, dict):
+        return item.get("content") or item.get("text") or json.dumps(item)
+    return str(item)
+
+
+def _iter_json_lines(path: str) -> Iterator[tuple[int, object]]:
+    """Record di un file JSONL con il numero di riga, saltando le righe vuote o non valide."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Riga {line_number} non valida in {path}: {e}")
+
+
+def _iter_json_array(path: str) -> Iterator[tuple[int, object]]:
+    """
+    Elementi di un array JSON con la riga in cui iniziano, letti a blocchi.
+
+    In memoria resta solo il blocco corrente (più l'elemento in corso di
+    lettura), non l'intero file.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, pos, line, eof = "", 0, 1, False
+
+        def read_more() -> bool:
+            nonlocal buffer, pos, eof
+            data = "" if eof else f.read(_READ_SIZE)
+            if not data:
+                eof = True
+                return False
+            buffer, pos = buffer[pos:] + data, 0
+            return True
+
+        def next_char() -> str:
+            """Salta gli spazi e restituisce il prossimo carattere significativo ('' a fine file)."""
+            nonlocal pos, line
+            while True:
+                end = _WHITESPACE.match(buffer, pos).end()
+                line += buffer.count("\n", pos, end)
+                pos = end
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not read_more():
+                    return ""
+
+        if next_char() != "[":
+            raise ValueError("il file non contiene un array JSON")
+        pos += 1
+        if next_char() == "]":
+            return
+
+        while True:
+            next_char()
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if not read_more():
+                        raise
+                    continue
+                # Un valore che arriva a fine blocco (es. un numero) potrebbe continuare nel blocco successivo
+                if end < len(buffer) or not read_more():
+                    break
+
+            yield line, item
+            line += buffer.count("\n", pos, end)
+            pos = end
+
+            separator = next_char()
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError(f"JSON non valido alla riga {line}")
+            pos += 1
+
+
+def is_record_file(path: str) -> bool:
+    """True per i file con un documento per record: .jsonl e .json il cui contenuto è un array."""
+    extension = Path(path).suffix.lower()
+    if extension == ".jsonl":
+        return True
+    if extension != ".json":
+        return False
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return f.read(4096).lstrip().startswith("[")
+
+
+def iter_records(path: str) -> Iterator[dict]:
+    """
+    Carica un file a record (.jsonl o array JSON) in streaming, un documento per record.
+
+    Args:
+        path: Percorso del file
+
+    Yields:
+        Documenti con 'source' = "percorso#riga" e 'path' = percorso del file
+    """
+    if Path(path).suffix.lower() == ".jsonl":
+        records, doc_type = _iter_json_lines(path), "jsonl"
+    else:
+        records, doc_type = _iter_json_array(path), "json"
+
+    for line, item in records:
+        content = _record_text(item)
+        if content.strip():
+            yield {
+                "content": content,
+                "source": f"{path}#{line}",
+                "path": path,
+                "type": doc_type,
+            }
+
+
+def document_path(doc: dict) -> str:
+    """Percorso del file da cui proviene un documento (anche per i documenti dei file a record)."""
+    return doc.get("path", doc["source"])
+
+
+_LOADERS = {
+    ".txt": load_txt,
+    ".md": load_markdown,
+    ".markdown": load_markdown,
+    ".pdf": load_pdf,
+    ".json": load_json,
+}
+
+
 def load_document(path: str) -> Optional[dict]:
     """
     Carica un singolo documento in base alla sua estensione.
     Restituisce None se il formato non è supportato.
     """
-    path_obj = Path(path)
-    extension = path_obj.suffix.lower()
-
-    loaders = {
-        ".txt": load_txt,
-        ".md": load_markdown,
-        ".markdown": load_markdown,
-        ".pdf": load_pdf,
-        ".json": load_json,
-    }
-
-    loader = loaders.get(extension)
+    loader = _LOADERS.get(Path(path).suffix.lower())
     if loader:
         try:
             return loader(path)
@@ -102,23 +314,257 @@ def load_document(path: str) -> Optional[dict]:
     return None
 
 
-def load_directory(directory: str) -> list[dict]:
+def list_documents(directory: str) -> list[str]:
     """
-    Carica tutti i documenti supportati da una cartella.
-    Supporta: .txt, .md, .markdown, .pdf, .json
+    Elenca i file supportati di una cartella (ricorsivamente), in ordine.
     """
-    documents = []
-    supported_extensions = {".txt", ".md", ".markdown", ".pdf", ".json"}
-
     directory_path = Path(directory)
     if not directory_path.exists():
         raise FileNotFoundError(f"Directory non trovata: {directory}")
 
-    for file_path in directory_path.rglob("*"):
-        if file_path.is_file() and file_path.suffix.lower() in supported_extensions:
-            doc = load_document(str(file_path))
-            if doc and doc["content"].strip():
-                documents.append(doc)
-                print(f"  Caricato: {file_path.name}")
+    return sorted(
+        str(file_path)
+        for file_path in directory_path.rglob("*")
+        if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_EXTENSIONS
+    )
+
+
+def file_fingerprint(path: str, content_hash: bool = False) -> dict:
+    """
+    Dimensione e data di modifica di un file, più l'hash SHA-256 del contenuto se richiesto.
+    """
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+    if content_hash:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        fingerprint["sha256"] = digest.hexdigest()
+
+    return fingerprint
+
+
+def _load_timed(position: int, path: str, fingerprint: bool = False) -> tuple:
+    """Carica un documento (anche in un processo worker): (posizione, percorso, documento, errore, secondi)."""
+    start = time.perf_counter()
+    try:
+        # Impronta presa prima della lettura: se il file cambia nel frattempo, al prossimo ingest risulta modificato
+        stamp = file_fingerprint(path, content_hash=True) if fingerprint else None
+        doc, error = _LOADERS[Path(path).suffix.lower()](path), None
+        if stamp:
+            doc["fingerprint"] = stamp
+    except Exception as e:
+        doc, error = None, str(e) or type(e).__name__
+    return position, path, doc, error, time.perf_counter() - start
+
+
+def _load_pool(paths: list[str], workers: int, timeout: float, fingerprint: bool = False) -> Iterator[tuple]:
+    """
+    Carica i file in un pool di processi, producendo i risultati in ordine di completamento.
+
+    Ogni worker riceve un file alla volta, quindi un file inizia appena
+    inviato. Se un file supera il timeout il pool viene terminato (è l'unico
+    modo di interrompere l'estrazione in corso) e ricreato: il file viene
+    segnato come fallito e gli altri file in corso vengono ripresi.
+
+    I worker partono da un processo forkserver (spawn dove non è disponibile):
+    un fork diretto copierebbe lo stato dei thread attivi (stadi della
+    pipeline, monitor di pymongo) e potrebbe bloccarsi su un lock. Il
+    forkserver importa questo modulo una volta sola, così i pool ricreati
+    dopo un timeout partono senza ripetere gli import.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["__main__", __name__])
+    else:
+        context = multiprocessing.get_context("spawn")
+    pending = deque(enumerate(paths))
+    results = queue.Queue()
+    generation = 0
+
+    while pending:
+        generation += 1
+        running = {}
+
+        with context.Pool(min(workers, len(pending))) as pool:
+            def submit():
+                while pending and len(running) < workers:
+                    position, path = pending.popleft()
+                    running[position] = (path, time.monotonic())
+                    pool.apply_async(
+                        _load_timed,
+                        (position, path, fingerprint),
+                        callback=lambda result, g=generation: results.put((g, result)),
+                        error_callback=lambda e, g=generation, p=position, f=path: results.put(
+                            (g, (p, f, None, str(e) or type(e).__name__, 0.0))
+                        ),
+                    )
+
+            submit()
+            while running:
+                wait = None
+                if timeout > 0:
+                    oldest = min(started for _, started in running.values())
+                    wait = max(timeout - (time.monotonic() - oldest), 0.0)
+                try:
+                    result_generation, result = results.get(timeout=wait)
+                except queue.Empty:
+                    break
+                if result_generation != generation or result[0] not in running:
+                    continue
+                del running[result[0]]
+                yield result
+                submit()
+
+            # Timeout: i file oltre il limite falliscono, gli altri in corso ripartono nel nuovo pool
+            now = time.monotonic()
+            timed_out = []
+            for position, (path, started) in sorted(running.items(), reverse=True):
+                if now - started >= timeout:
+                    timed_out.append((position, path, None, f"timeout dopo {timeout:g}s", now - started))
+                else:
+                    pending.appendleft((position, path))
 
-    return documents
+        # Uscendo dal blocco with il pool (e l'estrazione bloccata) viene terminato
+        yield from reversed(timed_out)
+
+
+def iter_load_files(
+    paths: list[str],
+    workers: int = DEFAULT_LOAD_WORKERS,
+    timeout: float = DEFAULT_LOAD_TIMEOUT,
+    summary: Optional[dict] = None,
+    slow_seconds: float = DEFAULT_SLOW_LOAD_SECONDS,
+    fingerprint: bool = False,
+) -> Iterator[dict]:
+    """
+    Carica i file indicati in parallelo, producendo i documenti man mano che sono pronti.
+
+    I documenti arrivano in ordine di completamento, non nell'ordine dei
+    percorsi. File non leggibili, vuoti o oltre il timeout vengono saltati.
+    I file a record (.jsonl, array JSON) sono letti per ultimi, in streaming
+    nel processo corrente e senza timeout: un documento per record.
+
+    Args:
+        paths: Percorsi dei file
+        workers: Processi di caricamento (0 = uno per core, 1 = nel processo corrente, senza timeout)
+        timeout: Secondi massimi per file (0 = nessun limite)
+        summary: Dizionario da riempire con il riepilogo (vedi print_load_summary)
+        slow_seconds: Soglia dei file lenti nel riepilogo
+        fingerprint: Se True, ogni documento riporta in 'fingerprint' l'impronta del
+            file (vedi file_fingerprint) presa al momento della lettura
+
+    Yields:
+        Documenti con campi 'content', 'source', 'type'
+    """
+    paths = [path for path in paths if Path(path).suffix.lower() in SUPPORTED_EXTENSIONS]
+    is_record = {path: is_record_file(path) for path in paths}
+    record_paths = [path for path in paths if is_record[path]]
+    file_paths = [path for path in paths if not is_record[path]]
+    workers = min(workers or os.cpu_count() or 1, len(file_paths))
+    if summary is None:
+        summary = {}
+    summary.update({
+        "files": len(paths),
+        "loaded": 0,
+        "records": 0,
+        "empty": 0,
+        "failed": [],
+        "slow": [],
+        "seconds": 0.0,
+    })
+
+    start = time.perf_counter()
+    if workers > 1:
+        results = _load_pool(file_paths, workers, timeout, fingerprint)
+    else:
+        results = (_load_timed(position, path, fingerprint) for position, path in enumerate(file_paths))
+
+    for _, path, doc, error, seconds in results:
+        if seconds >= slow_seconds:
+            summary["slow"].append((path, seconds))
+        if error:
+            print(f"Errore caricando {path}: {error}")
+            summary["failed"].append((path, error))
+        elif not doc["content"].strip():
+            summary["empty"] += 1
+        else:
+            summary["loaded"] += 1
+            print(f"  Caricato: {Path(path).name}")
+            yield doc
+        summary["seconds"] = time.perf_counter() - start
+
+    for path in record_paths:
+        count, failed = 0, False
+        try:
+            stamp = file_fingerprint(path, content_hash=True) if fingerprint else None
+            for doc in iter_records(path):
+                count += 1
+                if stamp:
+                    doc["fingerprint"] = stamp
+                yield doc
+        except Exception as e:
+            print(f"Errore caricando {path}: {e}")
+            summary["failed"].append((path, str(e)))
+            failed = True
+
+        if count:
+            summary["loaded"] += 1
+            summary["records"] += count
+            print(f"  Caricato: {Path(path).name} ({count} record)")
+        elif not failed:
+            summary["empty"] += 1
+        summary["seconds"] = time.perf_counter() - start
+
+
+def print_load_summary(summary: dict):
+    """Stampa il riepilogo del caricamento: durata, file lenti e falliti."""
+    print(
+        f"  Caricati {summary['loaded']} file su {summary['files']} in {summary['seconds']:.1f}s "
+        f"({summary['empty']} vuoti, {len(summary['failed'])} falliti)"
+    )
+    if summary["records"]:
+        print(f"  Record da file JSONL/JSON: {summary['records']}")
+    for path, seconds in sorted(summary["slow"], key=lambda item: -item[1]):
+        print(f"  Lento: {Path(path).name} ({seconds:.1f}s)")
+    for path, error in summary["failed"]:
+        print(f"  Fallito: {Path(path).name} ({error})")
+
+
+def load_files(
+    paths: list[str],
+    workers: int = DEFAULT_LOAD_WORKERS,
+    timeout: float = DEFAULT_LOAD_TIMEOUT,
+    summary: Optional[dict] = None,
+) -> list[dict]:
+    """
+    Carica i file indicati, saltando quelli non leggibili, vuoti o oltre il timeout.
+
+    Args:
+        paths: Percorsi dei file
+        workers: Processi di caricamento (0 = uno per core)
+        timeout: Secondi massimi per file (0 = nessun limite)
+        summary: Dizionario da riempire con il riepilogo (opzionale)
+
+    Returns:
+        Documenti nell'ordine dei percorsi (e dei record all'interno di un file)
+    """
+    summary = {} if summary is None else summary
+    order = {path: position for position, path in enumerate(paths)}
+    documents = list(iter_load_files(paths, workers, timeout, summary))
+    print_load_summary(summary)
+    return sorted(documents, key=lambda doc: order[document_path(doc)])
+
+
+def load_directory(
+    directory: str,
+    workers: int = DEFAULT_LOAD_WORKERS,
+    timeout: float = DEFAULT_LOAD_TIMEOUT,
+) -> list[dict]:
+    """
+    Carica tutti i documenti supportati da una cartella.
+    Supporta: .txt, .md, .markdown, .pdf, .json, .jsonl
+    """
+    return load_files(list_documents(directory), workers, timeout)
@@ -0,0 +1,305 @@
+"""
+Local Embedder - Embeddings su CPU senza chiamate di rete
+Hashing di parole e bigrammi, pesatura TF-IDF e SVD troncata (LSA) con NumPy
+"""
+
+import os
+import re
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .disk_cache import DEFAULT_CACHE_DIR
+from .embedder import DEFAULT_BATCH_ITEMS, LOCAL_EMBEDDING_MODEL, BaseEmbedder, normalize_text
+from .vector_index import normalize_rows
+
+
+DEFAULT_LOCAL_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "256"))
+DEFAULT_LOCAL_FEATURES = int(os.getenv("LOCAL_EMBEDDING_FEATURES", str(2**20)))
+DEFAULT_LOCAL_FIT_CHUNKS = int(os.getenv("LOCAL_EMBEDDING_FIT_CHUNKS", "20000"))
+DEFAULT_LOCAL_MODEL_PATH = os.getenv("LOCAL_EMBEDDING_PATH", str(Path(DEFAULT_CACHE_DIR) / "local_embedder.npz"))
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+# SVD randomizzata: colonne extra e iterazioni di potenza per la precisione
+_SVD_OVERSAMPLE = 10
+_SVD_POWER_ITER = 2
+_SEED = 0
+
+# Frequenza documentale minima di un termine per entrare nel vocabolario
+_MIN_DF = 2
+
+# Elementi massimi dei prodotti intermedi per blocco (limita la memoria)
+_BLOCK_ELEMENTS = 1 << 24
+
+
+def hash_terms(text: str, n_features: int) -> Counter:
+    """
+    Conta parole e bigrammi del testo, mappati su n_features colonne tramite hashing.
+
+    Args:
+        text: Il testo
+        n_features: Numero di colonne dello spazio hash
+
+    Returns:
+        Counter colonna → occorrenze
+    """
+    tokens = _TOKEN_PATTERN.findall(normalize_text(text).lower())
+    terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return Counter(zlib.crc32(term.encode("utf-8")) % n_features for term in terms)
+
+
+def _sparse_rows(texts: list[str], n_features: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Matrice documenti × termini in formato CSR (indptr, indices, data) con tf sublineare."""
+    indptr = [0]
+    indices = []
+    data = []
+    for text in texts:
+        counts = hash_terms(text, n_features)
+        indices.extend(counts.keys())
+        data.extend(counts.values())
+        indptr.append(len(indices))
+
+    data = np.asarray(data, dtype=np.float32)
+    return (
+        np.asarray(indptr, dtype=np.int64),
+        np.asarray(indices, dtype=np.int64),
+        1.0 + np.log(data, out=data),
+    )
+
+
+def _csr_matmul(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, dense: np.ndarray) -> np.ndarray:
+    """Prodotto matrice sparsa (CSR) × matrice densa, a blocchi di righe."""
+    n_rows = len(indptr) - 1
+    out = np.zeros((n_rows, dense.shape[1]), dtype=np.float32)
+    max_nnz = max(_BLOCK_ELEMENTS // max(dense.shape[1], 1), 1)
+
+    start = 0
+    while start < n_rows:
+        stop = int(np.searchsorted(indptr, indptr[start] + max_nnz, side="right")) - 1
+        stop = min(max(stop, start + 1), n_rows)
+
+        lo, hi = indptr[start], indptr[stop]
+        if hi > lo:
+            products = data[lo:hi, None] * dense[indices[lo:hi]]
+            row_starts = indptr[start:stop] - lo
+            non_empty = indptr[start + 1 : stop + 1] > indptr[start:stop]
+            out[start:stop][non_empty] = np.add.reduceat(products, row_starts[non_empty], axis=0)
+        start = stop
+
+    return out
+
+
+def _transpose(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, n_cols: int):
+    """Trasposta di una matrice CSR, sempre in formato CSR."""
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    order = np.argsort(indices, kind="stable")
+    counts = np.bincount(indices, minlength=n_cols)
+    t_indptr = np.concatenate([[0], np.cumsum(counts)])
+    return t_indptr, rows[order], data[order]
+
+
+class LocalEmbedder(BaseEmbedder):
+    """
+    Embeddings LSA calcolati localmente.
+
+    Il modello (vocabolario hash, pesi IDF e proiezione SVD) viene adattato al
+    corpus alla prima indicizzazione e salvato su disco: le query successive,
+    anche da altri processi, usano la stessa proiezione. Se un altro processo
+    riadatta o elimina il modello, il file viene ricaricato al primo utilizzo.
+    """
+
+    def __init__(
+        self,
+        dim: int = DEFAULT_LOCAL_DIM,
+        n_features: int = DEFAULT_LOCAL_FEATURES,
+        model_path: str = DEFAULT_LOCAL_MODEL_PATH,
+        fit_chunks: int = DEFAULT_LOCAL_FIT_CHUNKS,
+    ):
+        """
+        Inizializza il backend locale, caricando il modello salvato se presente.
+
+        Args:
+            dim: Dimensioni degli embedding
+            n_features: Colonne dello spazio hash di parole e bigrammi
+            model_path: File .npz del modello adattato
+            fit_chunks: Chunk massimi (campione del corpus) su cui adattare il modello
+        """
+        self.model = LOCAL_EMBEDDING_MODEL
+        self.dim = dim
+        self.n_features = n_features
+        self.model_path = model_path
+        self.fit_chunks = fit_chunks
+
+        self.features: Optional[np.ndarray] = None
+        self.idf: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+
+        # mtime del file del modello caricato (None = nessun modello)
+        self._model_mtime: Optional[int] = None
+        self._refresh()
+
+    @property
+    def fitted(self) -> bool:
+        self._refresh()
+        return self.components is not None
+
+    @property
+    def model_version(self) -> str:
+        self._refresh()
+        return f"{self.model}/{self._model_mtime}"
+
+    def fit(self, texts: list[str]):
+        """
+        Adatta il modello a un corpus e lo salva su disco.
+
+        Args:
+            texts: Testi del corpus (tipicamente i chunk da indicizzare)
+        """
+        indptr, indices, data = _sparse_rows(texts, self.n_features)
+
+        # Vocabolario: colonne hash presenti in almeno _MIN_DF chunk (tutte, se il corpus è minimo)
+        features, df = np.unique(indices, return_counts=True)
+        if (df >= _MIN_DF).sum() >= self.dim:
+            features, df = features[df >= _MIN_DF], df[df >= _MIN_DF]
+        self.features = features
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+
+        indptr, indices, data = self._known(indptr, indices, data)
+        data = self._weight(indptr, indices, data)
+        self.components = self._svd(indptr, indices, data, len(self.features))
+        self._save()
+
+    def reset_model(self):
+        """Elimina il modello adattato: verrà riadattato alla prossima indicizzazione."""
+        self.features = self.idf = self.components = None
+        self._model_mtime = None
+        Path(self.model_path).unlink(missing_ok=True)
+
+    def get_embeddings_batch(
+        self,
+        texts: list[str],
+        batch_size: int = DEFAULT_BATCH_ITEMS,
+        max_concurrency: Optional[int] = None,
+        stats: Optional[dict] = None,
+    ) -> list[list[float]]:
+        """
+        Genera embeddings per una lista di testi (batch_size, max_concurrency e
+        stats sono ignorati: il calcolo è vettoriale su tutti i testi).
+
+        Args:
+            texts: Lista di testi
+
+        Returns:
+            Lista di embeddings (dim dimensioni, norma unitaria)
+        """
+        if not self.fitted:
+            raise RuntimeError("Modello di embedding locale non adattato: indicizza prima i documenti.")
+
+        indptr, indices, data = self._known(*_sparse_rows(texts, self.n_features))
+        data = self._weight(indptr, indices, data)
+
+        embeddings = normalize_rows(_csr_matmul(indptr, indices, data, self.components))
+        self.last_batch_stats = None
+        return embeddings.tolist()
+
+    def embed_chunks(
+        self,
+        chunks: list[dict],
+        batch_size: int = DEFAULT_BATCH_ITEMS,
+        max_concurrency: Optional[int] = None,
+        stats: Optional[dict] = None,
+    ) -> list[dict]:
+        """Come BaseEmbedder.embed_chunks; alla prima indicizzazione adatta il modello ai chunk."""
+        if not self.fitted:
+            print(f"  Adattamento modello locale su {len(chunks)} chunk...")
+            self.fit([chunk["text"] for chunk in chunks])
+        return super().embed_chunks(chunks, batch_size, max_concurrency, stats)
+
+    def _known(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray):
+        """Rimappa le colonne hash sulle posizioni del vocabolario, scartando i termini fuori vocabolario."""
+        positions = np.searchsorted(self.features, indices)
+        positions[positions == len(self.features)] = 0
+        known = self.features[positions] == indices
+
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        row_counts = np.bincount(rows[known], minlength=len(indptr) - 1)
+        return np.concatenate([[0], np.cumsum(row_counts)]), positions[known], data[known]
+
+    def _weight(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray) -> np.ndarray:
+        """Applica i pesi IDF e normalizza ogni riga a norma unitaria."""
+        data = data * self.idf[indices]
+        squares = np.zeros(len(indptr) - 1, dtype=np.float32)
+        non_empty = np.diff(indptr) > 0
+        if non_empty.any():
+            squares[non_empty] = np.add.reduceat(data * data, indptr[:-1][non_empty])
+        norms = np.sqrt(squares)
+        norms[norms == 0] = 1.0
+        return data / np.repeat(norms, np.diff(indptr))
+
+    def _svd(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, n_cols: int) -> np.ndarray:
+        """SVD troncata randomizzata: restituisce la proiezione termini → dim componenti."""
+        n_rows = len(indptr) - 1
+        rank = min(self.dim + _SVD_OVERSAMPLE, n_rows, n_cols)
+        transposed = _transpose(indptr, indices, data, n_cols)
+        rng = np.random.default_rng(_SEED)
+
+        # Base ortonormale dello spazio delle righe dominante (QR solo sul lato corto, documenti × rank)
+        q, _ = np.linalg.qr(_csr_matmul(indptr, indices, data, rng.standard_normal((n_cols, rank), dtype=np.float32)))
+        for _ in range(_SVD_POWER_ITER):
+            q, _ = np.linalg.qr(_csr_matmul(indptr, indices, data, _csr_matmul(*transposed, q)))
+
+        # B^T = X^T Q; i vettori singolari destri di X sono B^T W / sigma, con W autovettori di B B^T
+        b_t = _csr_matmul(*transposed, q)
+        eigenvalues, eigenvectors = np.linalg.eigh(b_t.T @ b_t)
+        order = np.argsort(eigenvalues)[::-1][: self.dim]
+        sigma = np.sqrt(np.maximum(eigenvalues[order], 1e-12))
+
+        components = np.zeros((n_cols, self.dim), dtype=np.float32)
+        components[:, : len(order)] = (b_t @ eigenvectors[:, order]) / sigma
+        return components
+
+    def _refresh(self):
+        """Ricarica il modello se il file è stato riscritto (o eliminato) da un altro processo."""
+        try:
+            mtime = os.stat(self.model_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._model_mtime:
+            return
+
+        if mtime is None:
+            self.features = self.idf = self.components = None
+            self._model_mtime = None
+        else:
+            self._load()
+
+    def _save(self):
+        path = Path(self.model_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Scrittura atomica: gli altri processi non leggono mai un file a metà
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                n_features=self.n_features,
+                features=self.features,
+                idf=self.idf,
+                components=self.components,
+            )
+        os.replace(tmp_path, path)
+        self._model_mtime = os.stat(path).st_mtime_ns
+
+    def _load(self):
+        mtime = os.stat(self.model_path).st_mtime_ns
+        with np.load(self.model_path) as saved:
+            self.n_features = int(saved["n_features"])
+            self.features = saved["features"]
+            self.idf = saved["idf"]
+            self.components = saved["components"]
+        self.dim = self.components.shape[1]
+        self._model_mtime = mtime
@@ -1,17 +1,112 @@
 """
 MongoDB Client - Interazione con MongoDB locale (Compass)
-Ricerca vettoriale implementata in Python con similarità coseno
+Ricerca vettoriale implementata in Python con similarità coseno (indice NumPy in memoria)
 """
 
 import math
 import os
-from typing import Optional
+import re
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Iterable, Optional
 
-from pymongo import MongoClient
+import numpy as np
+from bson.binary import Binary
+from pymongo import MongoClient, ReplaceOne, ReturnDocument, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError
+
+from .vector_index import DEFAULT_INDEX_TYPE, VectorIndex, create_vector_index, evaluate_recall
 
 
 DEFAULT_DB_NAME = "rag_db"
 DEFAULT_COLLECTION_NAME = "chunks"
+DEFAULT_VECTOR_ENCODING = os.getenv("VECTOR_ENCODING", "array")
+
+# Scrittura dei chunk: documenti per bulk_write e thread di scrittura in parallelo
+DEFAULT_WRITE_BATCH_SIZE = int(os.getenv("MONGODB_WRITE_BATCH_SIZE", "500"))
+DEFAULT_WRITE_WORKERS = int(os.getenv("MONGODB_WRITE_WORKERS", "1"))
+
+# Write concern della scrittura dei chunk: w ("1", "majority", "0"...) e journal; vuoti = default del server
+DEFAULT_WRITE_CONCERN = os.getenv("MONGODB_WRITE_CONCERN", "")
+DEFAULT_WRITE_JOURNAL = os.getenv("MONGODB_WRITE_JOURNAL", "")
+
+# Tipo BSON con cui è salvato l'embedding per ciascuna codifica
+_ENCODING_BSON_TYPES = {"array": "array", "binary": "binData"}
+
+# Versioni conservate nel log delle modifiche (oltre si ricarica l'indice da zero)
+_CHANGELOG_RETENTION = 1000
+
+# chunk_id per documento del log e per query $in
+_ID_BATCH_SIZE = 10000
+
+# Valori degli embedding convertiti in float32 per blocco durante il caricamento
+# dell'indice (circa 1300 vettori da 1536 dimensioni, ~64 MB di liste Python)
+_LOAD_BLOCK_ELEMENTS = 2 * 1024 * 1024
+
+# Frazione di righe cancellate oltre la quale l'indice viene ricostruito
+_MAX_DELETED_FRACTION = 0.3
+
+# Crescita dell'indice (righe / righe usate per centroidi IVF e scala int8) oltre la quale viene ricostruito
+_MAX_GROWTH = 2.0
+
+
+def write_concern_options(w: str = DEFAULT_WRITE_CONCERN, journal: str = DEFAULT_WRITE_JOURNAL) -> dict:
+    """Opzioni di WriteConcern dalle impostazioni testuali (dizionario vuoto = default del server)."""
+    options = {}
+    if w:
+        options["w"] = int(w) if w.isdigit() else w
+    if journal:
+        options["j"] = journal.lower() in ("1", "true", "yes")
+    return options
+
+
+def encode_embedding(embedding, encoding: str = DEFAULT_VECTOR_ENCODING):
+    """
+    Codifica un embedding per il salvataggio in MongoDB.
+
+    Args:
+        embedding: Vettore (lista di float o array NumPy)
+        encoding: "array" (array BSON di double) oppure "binary" (float32 little-endian)
+
+    Returns:
+        Lista di float oppure Binary BSON
+    """
+    if encoding == "binary":
+        return Binary(np.asarray(embedding, dtype="<f4").tobytes())
+    if encoding == "array":
+        return embedding if isinstance(embedding, list) else np.asarray(embedding, dtype=float).tolist()
+    raise ValueError(f"Codifica vettori non supportata: {encoding}")
+
+
+def decode_embedding(value):
+    """
+    Decodifica un embedding letto da MongoDB, in entrambi i formati.
+
+    I blob binari sono decodificati senza copia con np.frombuffer.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype="<f4")
+    return value
+
+
+def _has_embedding(doc: dict) -> bool:
+    """True se il documento ha un embedding non vuoto (lista, array o blob binario)."""
+    embedding = doc.get("embedding")
+    return embedding is not None and len(embedding) > 0
+
+
+def _filter_attributes(doc: dict) -> dict:
+    """Estrae da un chunk i valori usati dai filtri di ricerca."""
+    metadata = doc.get("metadata") or {}
+    return {
+        "source": doc.get("source"),
+        "type": metadata.get("type"),
+        # I chunk indicizzati senza "path" provengono da un file con la stessa fonte
+        "path": metadata.get("path") or doc.get("source"),
+    }
 
 
 def cosine_similarity(vec1: list[float], vec2: list[float]) -> float:
@@ -34,6 +129,13 @@ class MongoDBClient:
         uri: Optional[str] = None,
         db_name: str = DEFAULT_DB_NAME,
         collection_name: str = DEFAULT_COLLECTION_NAME,
+        two_phase: bool = True,
+        index_type: str = DEFAULT_INDEX_TYPE,
+        index_params: Optional[dict] = None,
+        vector_encoding: str = DEFAULT_VECTOR_ENCODING,
+        write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+        write_workers: int = DEFAULT_WRITE_WORKERS,
+        write_concern: Optional[dict] = None,
     ):
         """
         Inizializza la connessione a MongoDB.
@@ -42,6 +144,15 @@ class MongoDBClient:
             uri: Connection string MongoDB (default: localhost:27017)
             db_name: Nome del database
             collection_name: Nome della collection
+            two_phase: Se True, l'indice contiene solo chunk_id ed embedding e
+                testo/metadati vengono letti da MongoDB solo per i top-k
+            index_type: Tipo di indice vettoriale ("exact" oppure "ivf")
+            index_params: Parametri dell'indice (es. {"nprobe": 16, "quantization": "int8"})
+            vector_encoding: Formato degli embedding scritti ("array" oppure "binary")
+            write_batch_size: Documenti per bulk_write in insert_chunks
+            write_workers: Thread che scrivono i batch in parallelo
+            write_concern: Opzioni WriteConcern per i chunk (es. {"w": "majority", "j": True};
+                default da MONGODB_WRITE_CONCERN e MONGODB_WRITE_JOURNAL)
         """
         self.uri = uri or os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
         if not self.uri:
@@ -50,6 +161,36 @@ class MongoDBClient:
         self.client = MongoClient(self.uri, serverSelectionTimeoutMS=5000)
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
+        self.two_phase = two_phase
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        self.vector_encoding = vector_encoding
+        self.write_batch_size = max(write_batch_size, 1)
+        self.write_workers = max(write_workers, 1)
+
+        # Collection con il write concern scelto, usata per scrivere i chunk
+        write_concern = write_concern_options() if write_concern is None else write_concern
+        self._chunk_writer = (
+            self.collection.with_options(write_concern=WriteConcern(**write_concern))
+            if write_concern else self.collection
+        )
+        self.last_write_stats: Optional[dict] = None
+
+        # Versione dell'indice e log delle modifiche, condivisi tra processi
+        self.meta = self.db[f"{collection_name}_meta"]
+        self.changes = self.db[f"{collection_name}_changes"]
+
+        # Manifest dei file indicizzati (dimensione, mtime, hash) per l'ingest incrementale
+        self.manifest = self.db[f"{collection_name}_manifest"]
+
+        # Run di indicizzazione: parametri e avanzamento, per riprendere una run interrotta
+        self.runs = self.db[f"{collection_name}_ingest_runs"]
+
+        # Indice vettoriale in memoria, caricato alla prima ricerca e
+        # aggiornato in modo incrementale quando la versione cambia
+        self._index: Optional[VectorIndex] = None
+        self._index_version = 0
+        self._payloads: dict[str, dict] = {}
 
         # Test connessione
         try:
@@ -57,63 +198,618 @@ class MongoDBClient:
         except Exception as e:
             raise ConnectionError(f"Impossibile connettersi a MongoDB: {e}")
 
-    def insert_chunks(self, chunks: list[dict]) -> int:
+        # Indice univoco su chunk_id: upsert idempotenti e recupero dei top-k con $in
+        self._ensure_chunk_id_index()
+        self.collection.create_index("source")
+        self.changes.create_index("version")
+
+    def _ensure_chunk_id_index(self):
+        """Crea l'indice univoco su chunk_id, sostituendo quello non univoco delle versioni precedenti."""
+        existing = self.collection.index_information().get("chunk_id_1")
+        if existing and not existing.get("unique"):
+            self.collection.drop_index("chunk_id_1")
+        self.collection.create_index("chunk_id", unique=True)
+
+    def insert_chunks(self, chunks: list[dict], run_id: Optional[str] = None) -> int:
         """
-        Inserisce chunk con embeddings nella collection.
+        Inserisce (upsert per chunk_id) chunk con embeddings nella collection.
+
+        I chunk_id derivano da fonte, posizione e contenuto: reindicizzare gli
+        stessi file sostituisce i documenti esistenti invece di duplicarli.
+        Con run_id ogni chunk scritto (anche se già presente) viene marcato
+        con la run, così i chunk non riscritti dalla run sono riconoscibili.
+
+        La scrittura avviene a batch di write_batch_size documenti (bulk_write
+        non ordinati, anche su più thread): il payload in memoria è limitato al
+        batch e un documento rifiutato non blocca gli altri. I chunk rifiutati
+        sono esclusi dal conteggio e riportati in last_write_stats.
 
         Args:
             chunks: Lista di chunk con campi 'chunk_id', 'text', 'embedding', 'source', 'metadata'
+            run_id: Run di indicizzazione che scrive i chunk (opzionale)
 
         Returns:
-            Numero di documenti inseriti
+            Numero di chunk nuovi (non già presenti nella collection)
         """
+        chunks = list({chunk["chunk_id"]: chunk for chunk in chunks}.values())
+        if run_id is not None:
+            chunks = [{**chunk, "run_id": run_id} for chunk in chunks]
         if not chunks:
             return 0
 
-        result = self.collection.insert_many(chunks)
-        return len(result.inserted_ids)
+        existing = self.existing_chunk_ids([chunk["chunk_id"] for chunk in chunks])
+
+        start = time.perf_counter()
+        batches = [chunks[i : i + self.write_batch_size] for i in range(0, len(chunks), self.write_batch_size)]
+        workers = min(self.write_workers, len(batches))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                batch_errors = list(executor.map(self._write_batch, batches))
+        else:
+            batch_errors = [self._write_batch(batch) for batch in batches]
+        seconds = time.perf_counter() - start
+
+        errors = {chunk_id: message for errors in batch_errors for chunk_id, message in errors.items()}
+        written = len(chunks) - len(errors)
+        self.last_write_stats = {
+            "documents": written,
+            "batches": len(batches),
+            "workers": workers,
+            "seconds": seconds,
+            "docs_per_second": written / seconds if seconds > 0 else 0.0,
+            "errors": errors,
+        }
+
+        # Solo i chunk nuovi cambiano l'indice: quelli esistenti hanno lo stesso contenuto
+        new_chunks = [
+            chunk for chunk in chunks
+            if chunk["chunk_id"] not in existing and chunk["chunk_id"] not in errors
+        ]
+        if not new_chunks:
+            return 0
+
+        version = self._record_change("add", [chunk["chunk_id"] for chunk in new_chunks])
+
+        # Se l'indice in memoria è allineato, applica subito l'aggiunta (o lo scarta, se va ricostruito)
+        if self._index is not None and self._index_version == version - 1:
+            indexed = [chunk for chunk in new_chunks if _has_embedding(chunk)]
+            if self._outgrown(len(self._index) + len(indexed)):
+                self.invalidate_index()
+            else:
+                self._add_to_index(self._index, indexed)
+                self._index_version = version
+
+        return len(new_chunks)
+
+    def _write_batch(self, chunks: list[dict]) -> dict[str, str]:
+        """Upsert non ordinato di un batch di chunk; restituisce chunk_id → errore dei documenti rifiutati."""
+        operations = [
+            ReplaceOne(
+                {"chunk_id": chunk["chunk_id"]},
+                {**chunk, "embedding": encode_embedding(chunk["embedding"], self.vector_encoding)}
+                if chunk.get("embedding") is not None else chunk,
+                upsert=True,
+            )
+            for chunk in chunks
+        ]
+        try:
+            self._chunk_writer.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Un write concern non soddisfatto riguarda tutto il batch: va segnalato al chiamante
+            if e.details.get("writeConcernErrors"):
+                raise
+            return {chunks[error["index"]]["chunk_id"]: error.get("errmsg", "") for error in e.details["writeErrors"]}
+        return {}
+
+    def existing_chunk_ids(self, chunk_ids: list[str], run_id: Optional[str] = None) -> set[str]:
+        """Restituisce i chunk_id indicati già presenti nella collection (scritti dalla run indicata, se data)."""
+        existing = set()
+        for start in range(0, len(chunk_ids), _ID_BATCH_SIZE):
+            query = {"chunk_id": {"$in": chunk_ids[start : start + _ID_BATCH_SIZE]}}
+            if run_id is not None:
+                query["run_id"] = run_id
+            cursor = self.collection.find(
+                query,
+                {"_id": 0, "chunk_id": 1},
+            )
+            existing.update(doc["chunk_id"] for doc in cursor)
+        return existing
+
+    def delete_chunks(self, chunk_ids: list[str]) -> int:
+        """
+        Elimina i chunk indicati.
+
+        Args:
+            chunk_ids: Identificativi dei chunk da eliminare
+
+        Returns:
+            Numero di documenti eliminati
+        """
+        if not chunk_ids:
+            return 0
+
+        deleted = 0
+        for start in range(0, len(chunk_ids), _ID_BATCH_SIZE):
+            batch = chunk_ids[start : start + _ID_BATCH_SIZE]
+            deleted += self.collection.delete_many({"chunk_id": {"$in": batch}}).deleted_count
+        version = self._record_change("delete", chunk_ids)
+
+        if self._index is not None and self._index_version == version - 1:
+            self._remove_from_index(chunk_ids)
+            self._index_version = version
+
+        return deleted
+
+    def delete_by_source(self, sources: list[str], except_run: Optional[str] = None) -> int:
+        """
+        Elimina i chunk delle fonti indicate, inclusi quelli dei record di un
+        file (fonte "percorso#riga").
+
+        Args:
+            sources: Fonti (percorsi dei file) di cui eliminare i chunk
+            except_run: Conserva i chunk scritti da questa run (es. quella che ha reindicizzato i file)
+
+        Returns:
+            Numero di documenti eliminati
+        """
+        if not sources:
+            return 0
+
+        chunk_ids = []
+        for start in range(0, len(sources), _ID_BATCH_SIZE):
+            batch = sources[start : start + _ID_BATCH_SIZE]
+            # Regex ancorate all'inizio: usano l'indice su source come un prefisso
+            patterns = [re.compile(f"^{re.escape(source)}#") for source in batch]
+            query = {"source": {"$in": batch + patterns}}
+            if except_run is not None:
+                # Il confronto avviene sul server: il client non tiene i chunk_id della run
+                query["run_id"] = {"$ne": except_run}
+            cursor = self.collection.find(query, {"_id": 0, "chunk_id": 1})
+            chunk_ids.extend(doc["chunk_id"] for doc in cursor)
+
+        return self.delete_chunks(chunk_ids)
+
+    def get_manifest(self) -> dict[str, dict]:
+        """Restituisce il manifest dei file indicizzati: fonte → size, mtime, sha256, chunks."""
+        return {doc.pop("_id"): doc for doc in self.manifest.find()}
+
+    def update_manifest(self, entries: dict[str, dict]):
+        """Registra (o aggiorna) le voci del manifest, indicizzate per fonte."""
+        if not entries:
+            return
+        self.manifest.bulk_write(
+            [ReplaceOne({"_id": source}, {"_id": source, **entry}, upsert=True) for source, entry in entries.items()],
+            ordered=False,
+        )
+
+    def delete_manifest(self, sources: list[str]):
+        """Rimuove dal manifest le fonti indicate."""
+        if sources:
+            self.manifest.delete_many({"_id": {"$in": sources}})
+
+    def start_run(self, params: dict) -> str:
+        """
+        Registra una nuova run di indicizzazione.
+
+        Args:
+            params: Parametri dell'ingest, riusati per riprendere la run
+
+        Returns:
+            Identificativo della run (data e ora più un suffisso casuale)
+        """
+        now = datetime.now(timezone.utc)
+        run_id = f"{now:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.runs.insert_one({
+            "_id": run_id,
+            "status": "running",
+            "params": params,
+            "started_at": now,
+            "updated_at": now,
+            "attempts": 1,
+            "batches": 0,
+            "chunks_stored": 0,
+            "chunks_inserted": 0,
+        })
+        return run_id
+
+    def get_run(self, run_id: str) -> Optional[dict]:
+        """Restituisce una run di indicizzazione, oppure None."""
+        return self.runs.find_one({"_id": run_id})
+
+    def list_runs(self, limit: int = 10) -> list[dict]:
+        """Restituisce le run più recenti."""
+        return list(self.runs.find().sort("started_at", -1).limit(limit))
+
+    def resume_run(self, run_id: str):
+        """Segna una run come di nuovo in corso (ripresa)."""
+        self.runs.update_one(
+            {"_id": run_id},
+            {"$set": {"status": "running", "updated_at": datetime.now(timezone.utc)}, "$inc": {"attempts": 1}},
+        )
+
+    def record_run_batch(self, run_id: str, stored: int, inserted: int):
+        """Registra un batch di chunk salvato dalla run."""
+        self.runs.update_one(
+            {"_id": run_id},
+            {
+                "$inc": {"batches": 1, "chunks_stored": stored, "chunks_inserted": inserted},
+                "$set": {"updated_at": datetime.now(timezone.utc)},
+            },
+        )
+
+    def finish_run(self, run_id: str, status: str, error: Optional[str] = None):
+        """Chiude una run come completata ('completed') o interrotta ('failed')."""
+        self.runs.update_one(
+            {"_id": run_id},
+            {"$set": {"status": status, "error": error, "updated_at": datetime.now(timezone.utc)}},
+        )
+
+    def get_index_version(self) -> int:
+        """Restituisce la versione corrente della collection (incrementata a ogni modifica)."""
+        doc = self.meta.find_one({"_id": "index"})
+        return doc["version"] if doc else 0
+
+    def _record_change(self, op: str, chunk_ids: list[str]) -> int:
+        """
+        Incrementa la versione e registra la modifica nel log.
+
+        Args:
+            op: "add", "delete" oppure "clear"
+            chunk_ids: chunk aggiunti o eliminati (vuoto per "clear")
+
+        Returns:
+            La nuova versione
+        """
+        version = self.meta.find_one_and_update(
+            {"_id": "index"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )["version"]
+
+        if op == "clear":
+            self.changes.delete_many({})
+
+        batches = [
+            chunk_ids[start : start + _ID_BATCH_SIZE] for start in range(0, len(chunk_ids), _ID_BATCH_SIZE)
+        ] or [[]]
+        # "parts": voci della versione, per riconoscere un log letto mentre viene scritto
+        entries = [{"version": version, "op": op, "chunk_ids": batch, "parts": len(batches)} for batch in batches]
+        self.changes.insert_many(entries)
+        self.changes.delete_many({"version": {"$lte": version - _CHANGELOG_RETENTION}})
+
+        return version
 
     def vector_search(
         self,
         query_embedding: list[float],
         k: int = 5,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Optional[dict] = None,
     ) -> list[dict]:
         """
-        Esegue una ricerca vettoriale calcolando la similarità coseno in Python.
+        Esegue una ricerca vettoriale sull'indice NumPy in memoria (similarità coseno).
 
         Args:
             query_embedding: Embedding della query (1536 dimensioni)
             k: Numero di risultati da restituire
+            nprobe: Liste IVF da esaminare (solo indice "ivf"; più alto = recall migliore)
+            exact: Se True, forza la ricerca esatta anche con indice approssimato
+            filters: Filtri applicati prima dello scoring: "source", "type" e "path"
+                (valore o lista), "path_prefix" (prefisso del percorso del file)
 
         Returns:
             Lista di chunk più simili con score
         """
-        # Recupera tutti i documenti con embedding
-        all_docs = list(self.collection.find(
-            {"embedding": {"$exists": True}},
-            {"_id": 0, "chunk_id": 1, "text": 1, "source": 1, "metadata": 1, "embedding": 1}
-        ))
-
-        if not all_docs:
-            return []
-
-        # Calcola similarità per ogni documento
-        scored_docs = []
-        for doc in all_docs:
-            embedding = doc.get("embedding", [])
-            if embedding:
-                score = cosine_similarity(query_embedding, embedding)
-                scored_docs.append({
-                    "chunk_id": doc.get("chunk_id"),
+        index = self._get_index()
+        hits = index.search(query_embedding, k, nprobe=nprobe, exact=exact, filters=filters)
+        return self._hydrate([hits])[0]
+
+    def vector_search_batch(
+        self,
+        query_embeddings: list[list[float]],
+        k: int = 5,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Optional[dict] = None,
+    ) -> list[list[dict]]:
+        """
+        Esegue più ricerche vettoriali insieme (un prodotto matrice-matrice).
+
+        Args:
+            query_embeddings: Embedding delle query
+            k: Numero di risultati per query
+            nprobe: Liste IVF da esaminare (solo indice "ivf")
+            exact: Se True, forza la ricerca esatta anche con indice approssimato
+            filters: Filtri comuni a tutte le query (vedi vector_search)
+
+        Returns:
+            Per ogni query, la lista di chunk più simili con score
+        """
+        index = self._get_index()
+        hits = index.search_batch(query_embeddings, k, nprobe=nprobe, exact=exact, filters=filters)
+        return self._hydrate(hits)
+
+    def _hydrate(self, hits_per_query: list[list[tuple[str, float]]]) -> list[list[dict]]:
+        """Converte le coppie (chunk_id, score) nei dizionari risultato, con un'unica lettura $in."""
+        if self.two_phase:
+            chunk_ids = list({chunk_id for hits in hits_per_query for chunk_id, _ in hits})
+            payloads = self._fetch_payloads(chunk_ids)
+        else:
+            payloads = self._payloads
+
+        all_results = []
+        for hits in hits_per_query:
+            results = []
+            for chunk_id, score in hits:
+                payload = payloads.get(chunk_id)
+                if payload is None:
+                    continue
+                results.append({
+                    "chunk_id": chunk_id,
+                    "text": payload.get("text"),
+                    "source": payload.get("source"),
+                    "metadata": payload.get("metadata"),
+                    "score": score,
+                })
+            all_results.append(results)
+
+        return all_results
+
+    def _fetch_payloads(self, chunk_ids: list[str]) -> dict[str, dict]:
+        """Recupera testo, fonte e metadati dei chunk indicati con un'unica query $in."""
+        if not chunk_ids:
+            return {}
+
+        cursor = self.collection.find(
+            {"chunk_id": {"$in": chunk_ids}},
+            {"_id": 0, "chunk_id": 1, "text": 1, "source": 1, "metadata": 1},
+        )
+        return {doc["chunk_id"]: doc for doc in cursor}
+
+    def _fetch_vectors(self, chunk_ids: list[str]) -> dict[str, list[float]]:
+        """Recupera gli embedding a precisione piena dei chunk indicati (rescoring)."""
+        if not chunk_ids:
+            return {}
+
+        cursor = self.collection.find(
+            {"chunk_id": {"$in": chunk_ids}},
+            {"_id": 0, "chunk_id": 1, "embedding": 1},
+        )
+        return {doc["chunk_id"]: decode_embedding(doc["embedding"]) for doc in cursor}
+
+    def invalidate_index(self):
+        """Scarta l'indice in memoria: verrà ricaricato alla prossima ricerca."""
+        self._index = None
+        self._payloads = {}
+
+    def _get_index(self) -> VectorIndex:
+        """
+        Restituisce l'indice in memoria allineato alla versione corrente.
+
+        Al primo utilizzo l'indice viene caricato da MongoDB; in seguito vengono
+        applicate solo le modifiche registrate nel log dopo l'ultima versione vista.
+        """
+        version = self.get_index_version()
+
+        if self._index is not None and version != self._index_version:
+            if not self._apply_changes(version):
+                self.invalidate_index()
+
+        if self._index is None:
+            self._index = self._load_index()
+            self._index_version = version
+
+        return self._index
+
+    def _apply_changes(self, version: int) -> bool:
+        """
+        Applica all'indice le modifiche tra la versione locale e quella indicata.
+
+        Returns:
+            False se serve una ricarica completa (log incompleto, "clear", troppe
+            cancellazioni o indice cresciuto troppo rispetto al build)
+        """
+        changes = list(
+            self.changes.find({"version": {"$gt": self._index_version, "$lte": version}})
+            .sort([("version", 1), ("_id", 1)])
+        )
+        # La versione viene incrementata prima di scrivere il log: una versione pubblicata
+        # può non avere ancora le sue voci, e va trattata come log incompleto
+        parts = defaultdict(int)
+        for change in changes:
+            parts[change["version"]] += 1
+        if set(parts) != set(range(self._index_version + 1, version + 1)):
+            return False
+        if any(parts[change["version"]] != change.get("parts", 1) for change in changes):
+            return False
+
+        pending: dict[str, None] = {}
+        for change in changes:
+            if change["op"] == "clear":
+                return False
+            if change["op"] == "add":
+                pending.update(dict.fromkeys(change["chunk_ids"]))
+            elif change["op"] == "delete":
+                for chunk_id in change["chunk_ids"]:
+                    pending.pop(chunk_id, None)
+                self._remove_from_index(change["chunk_ids"])
+
+        chunk_ids = list(pending)
+        chunk_ids = [c for c, present in zip(chunk_ids, self._index.contains(chunk_ids)) if not present]
+        if self._outgrown(len(self._index) + len(chunk_ids)):
+            return False
+        for start in range(0, len(chunk_ids), _ID_BATCH_SIZE):
+            cursor = self.collection.find(
+                {"chunk_id": {"$in": chunk_ids[start : start + _ID_BATCH_SIZE]}},
+                self._index_projection(),
+            )
+            self._add_to_index(self._index, [doc for doc in cursor if _has_embedding(doc)])
+
+        if self._index.n_deleted > _MAX_DELETED_FRACTION * len(self._index):
+            return False
+
+        self._index_version = version
+        return True
+
+    def _outgrown(self, rows: int) -> bool:
+        """
+        True se un indice di rows righe va ricostruito: centroidi IVF e scala int8
+        sono calcolati al build, e i vettori aggiunti dopo vengono solo assegnati
+        (es. un indice nato dal primo batch su una collection vuota).
+        """
+        trained = self._index.trained_rows
+        return trained > 0 and rows > _MAX_GROWTH * trained
+
+    def _new_index(self, index_type: Optional[str] = None, **overrides) -> VectorIndex:
+        """Crea un indice vuoto con i parametri del client."""
+        params = {**self.index_params, **overrides}
+        params.setdefault("vector_loader", self._fetch_vectors)
+        return create_vector_index(index_type or self.index_type, **params)
+
+    def _index_projection(self) -> dict:
+        """Campi letti da MongoDB per popolare l'indice (più i payload se non two_phase)."""
+        if self.two_phase:
+            return {"_id": 0, "chunk_id": 1, "embedding": 1, "source": 1, "metadata.type": 1, "metadata.path": 1}
+        return {"_id": 0, "chunk_id": 1, "embedding": 1, "text": 1, "source": 1, "metadata": 1}
+
+    def _load_index(self) -> VectorIndex:
+        """Carica gli embedding della collection in un nuovo VectorIndex."""
+        self._payloads = {}
+        index = self._new_index()
+
+        query = {"embedding": {"$exists": True, "$ne": []}}
+        expected = self.collection.count_documents(query)
+        cursor = self.collection.find(query, self._index_projection())
+        self._add_to_index(index, cursor, expected)
+
+        return index
+
+    def _add_to_index(self, index: VectorIndex, docs: Iterable[dict], expected: int = 0):
+        """
+        Aggiunge all'indice (e ai payload se non two_phase) i chunk con embedding.
+
+        Gli embedding vengono copiati a blocchi (_LOAD_BLOCK_ELEMENTS valori) in una
+        matrice float32 preallocata per expected righe, raddoppiata se non basta:
+        le liste Python dei vettori non restano mai in memoria tutte insieme.
+        """
+        chunk_ids = []
+        attributes = []
+        matrix: Optional[np.ndarray] = None
+        block = []
+
+        def flush():
+            nonlocal matrix
+            vectors = np.asarray(block, dtype=np.float32)
+            start = len(chunk_ids) - len(block)
+            if matrix is None:
+                matrix = np.empty((max(expected, len(chunk_ids)), vectors.shape[1]), dtype=np.float32)
+            elif len(chunk_ids) > len(matrix):
+                grown = np.empty((max(len(chunk_ids), 2 * len(matrix)), matrix.shape[1]), dtype=np.float32)
+                grown[:start] = matrix[:start]
+                matrix = grown
+            matrix[start : len(chunk_ids)] = vectors
+            block.clear()
+
+        for doc in docs:
+            chunk_id = doc["chunk_id"]
+            chunk_ids.append(chunk_id)
+            block.append(decode_embedding(doc["embedding"]))
+            attributes.append(_filter_attributes(doc))
+            if not self.two_phase:
+                self._payloads[chunk_id] = {
+                    "chunk_id": chunk_id,
                     "text": doc.get("text"),
                     "source": doc.get("source"),
                     "metadata": doc.get("metadata"),
-                    "score": score,
-                })
+                }
+            if len(block) * len(block[0]) >= _LOAD_BLOCK_ELEMENTS:
+                flush()
+
+        if block:
+            flush()
+        if chunk_ids:
+            index.add(chunk_ids, matrix[: len(chunk_ids)], attributes)
+
+    def _remove_from_index(self, chunk_ids: list[str]):
+        """Marca i chunk come cancellati nell'indice in memoria."""
+        self._index.remove(chunk_ids)
+        for chunk_id in chunk_ids:
+            self._payloads.pop(chunk_id, None)
+
+    def benchmark_index(self, k: int = 10, n_queries: int = 100, nprobe: Optional[int] = None) -> dict:
+        """
+        Confronta l'indice configurato con la ricerca esatta float32.
+
+        Le query sono embedding campionati dalla collection.
+
+        Args:
+            k: Numero di risultati per query
+            n_queries: Numero di query di prova
+            nprobe: Liste IVF da esaminare (solo indice "ivf")
+
+        Returns:
+            Dizionario con recall@k, latenze e memoria (vedi evaluate_recall)
+        """
+        chunk_ids = []
+        embeddings = []
+        cursor = self.collection.find(
+            {"embedding": {"$exists": True, "$ne": []}},
+            {"_id": 0, "chunk_id": 1, "embedding": 1},
+        )
+        for doc in cursor:
+            chunk_ids.append(doc["chunk_id"])
+            embeddings.append(decode_embedding(doc["embedding"]))
+
+        if not chunk_ids:
+            return {}
+
+        reference = self._new_index("exact", quantization="none", prefix_dim=0)
+        reference.build(chunk_ids, embeddings)
+        index = self._new_index()
+        index.build(chunk_ids, embeddings)
+
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(chunk_ids), size=min(n_queries, len(chunk_ids)), replace=False)
+        queries = reference.vectors(sample)
+
+        return evaluate_recall(index, reference, queries, k, nprobe=nprobe)
+
+    def migrate_embeddings(self, encoding: str, batch_size: int = 1000) -> int:
+        """
+        Converte gli embedding già salvati nella codifica indicata.
+
+        Args:
+            encoding: Codifica di destinazione ("array" oppure "binary")
+            batch_size: Documenti aggiornati per bulk_write
+
+        Returns:
+            Numero di documenti convertiti
+        """
+        if encoding not in _ENCODING_BSON_TYPES:
+            raise ValueError(f"Codifica vettori non supportata: {encoding}")
+
+        source_encoding = "array" if encoding == "binary" else "binary"
+        cursor = self.collection.find(
+            {"embedding": {"$type": _ENCODING_BSON_TYPES[source_encoding]}},
+            {"_id": 1, "embedding": 1},
+        )
+
+        migrated = 0
+        operations = []
+        for doc in cursor:
+            embedding = encode_embedding(decode_embedding(doc["embedding"]), encoding)
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"embedding": embedding}}))
+            if len(operations) >= batch_size:
+                migrated += self.collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+
+        if operations:
+            migrated += self.collection.bulk_write(operations, ordered=False).modified_count
 
-        # Ordina per score decrescente e prendi i top k
-        scored_docs.sort(key=lambda x: x["score"], reverse=True)
-        return scored_docs[:k]
+        self.vector_encoding = encoding
+        return migrated
 
     def delete_all(self) -> int:
         """
@@ -123,6 +819,9 @@ class MongoDBClient:
             Numero di documenti eliminati
         """
         result = self.collection.delete_many({})
+        self.manifest.delete_many({})
+        self._record_change("clear", [])
+        self.invalidate_index()
         return result.deleted_count
 
     def get_stats(self) -> dict:
@@ -146,6 +845,7 @@ class MongoDBClient:
             "total_documents": total_sources,
             "database": self.db.name,
             "collection": self.collection.name,
+            "index_version": self.get_index_version(),
         }
 
     def close(self):
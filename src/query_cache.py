@@ -0,0 +1,340 @@
+"""
+Query Cache - Cache in memoria delle query (embedding della domanda e risultati della ricerca)
+LRU con scadenza (TTL), invalidata a ogni modifica della collection, e cache
+semantica delle risposte per domande quasi identiche
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .vector_index import normalize_rows
+
+
+DEFAULT_QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+DEFAULT_QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+DEFAULT_ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+DEFAULT_ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+DEFAULT_ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+# Punteggiatura finale ignorata nel confronto tra domande ("Cos'è X?" == "cos'è x")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.;:,]+$")
+
+
+def normalize_question(question: str) -> str:
+    """Normalizza una domanda per il confronto: minuscole, spazi compattati, senza punteggiatura finale."""
+    question = " ".join(question.lower().split())
+    return _TRAILING_PUNCTUATION.sub("", question)
+
+
+def _freeze(value):
+    """Converte filtri (dict/liste) in una struttura hashable, indipendente dall'ordine."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted(_freeze(item) for item in value))
+    return value
+
+
+def search_key(k: int, nprobe: Optional[int], exact: bool, filters: Optional[dict]) -> tuple:
+    """Chiave dei parametri di ricerca, a parità di domanda."""
+    return (k, nprobe, exact, _freeze(filters or {}))
+
+
+class QueryCache:
+    """
+    Cache LRU domanda normalizzata → embedding e risultati della ricerca.
+
+    L'embedding dipende solo dal testo e resta valido finché la voce non scade;
+    i risultati sono legati alla versione della collection e vengono scartati
+    quando la versione cambia.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_QUERY_CACHE_SIZE, ttl: float = DEFAULT_QUERY_CACHE_TTL):
+        """
+        Inizializza la cache.
+
+        Args:
+            max_entries: Numero massimo di domande memorizzate (0 disabilita la cache)
+            ttl: Durata di una voce in secondi (0 = nessuna scadenza)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.embedding_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def lookup(self, question: str, key: tuple, version: int) -> tuple[Optional[list[float]], Optional[list[dict]]]:
+        """
+        Cerca una domanda in cache.
+
+        Args:
+            question: La domanda (non normalizzata)
+            key: Parametri di ricerca (vedi search_key)
+            version: Versione corrente della collection
+
+        Returns:
+            (embedding, risultati); ciascuno None se non presente
+        """
+        normalized = normalize_question(question)
+        with self._lock:
+            self._check_version(version)
+
+            entry = self._entries.get(normalized)
+            if entry is not None and self._expired(entry):
+                del self._entries[normalized]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None, None
+
+            self._entries.move_to_end(normalized)
+            results = entry["results"].get(key)
+            if results is None:
+                self.embedding_hits += 1
+                return entry["embedding"], None
+
+            self.hits += 1
+            return entry["embedding"], list(results)
+
+    def store(self, question: str, key: tuple, version: int, embedding: list[float], results: list[dict]):
+        """Memorizza embedding e risultati di una domanda, eliminando le voci meno recenti oltre il limite."""
+        if not self.enabled:
+            return
+
+        normalized = normalize_question(question)
+        with self._lock:
+            self._check_version(version)
+
+            entry = self._entries.get(normalized)
+            if entry is None or self._expired(entry):
+                entry = {"embedding": embedding, "results": {}, "created": time.monotonic()}
+                self._entries[normalized] = entry
+            entry["results"][key] = list(results)
+            self._entries.move_to_end(normalized)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Scarta i risultati memorizzati (gli embedding delle domande restano validi)."""
+        with self._lock:
+            self._drop_results()
+            self._version = None
+
+    def clear(self):
+        """Svuota la cache."""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def stats(self) -> dict:
+        """Restituisce numero di voci e contatori hit/miss."""
+        lookups = self.hits + self.embedding_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "embedding_hits": self.embedding_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _check_version(self, version: int):
+        """Scarta i risultati se la collection è cambiata dall'ultimo accesso."""
+        if self._version is not None and version != self._version:
+            self._drop_results()
+        self._version = version
+
+    def _drop_results(self):
+        if any(entry["results"] for entry in self._entries.values()):
+            self.invalidations += 1
+        for entry in self._entries.values():
+            entry["results"] = {}
+
+    def _expired(self, entry: dict) -> bool:
+        return self.ttl > 0 and time.monotonic() - entry["created"] > self.ttl
+
+
+class AnswerCache:
+    """
+    Cache semantica delle risposte.
+
+    Una risposta memorizzata viene riusata se la nuova domanda ha similarità
+    coseno almeno pari alla soglia con una domanda in cache e la ricerca ha
+    restituito gli stessi chunk (stesso contesto per il modello).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_ANSWER_CACHE_SIZE,
+        threshold: float = DEFAULT_ANSWER_CACHE_THRESHOLD,
+        ttl: float = DEFAULT_ANSWER_CACHE_TTL,
+    ):
+        """
+        Inizializza la cache.
+
+        Args:
+            max_entries: Numero massimo di risposte memorizzate (0 disabilita la cache)
+            threshold: Similarità coseno minima tra le domande
+            ttl: Durata di una risposta in secondi (0 = nessuna scadenza)
+        """
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.context_mismatches = 0
+        self.last_hit: Optional[dict] = None
+        self._hit_similarity = 0.0
+
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: list[int] = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def lookup(self, embedding: list[float], chunk_ids: list[str], context: tuple = ()) -> Optional[dict]:
+        """
+        Cerca una risposta per una domanda simile con lo stesso contesto.
+
+        Args:
+            embedding: Embedding della nuova domanda
+            chunk_ids: chunk_id recuperati per la nuova domanda, in ordine
+            context: Parametri di generazione che devono coincidere (es. modello e temperatura)
+
+        Returns:
+            Dizionario con 'answer', 'sources', 'question' (la domanda in cache)
+            e 'similarity', oppure None
+        """
+        query = _unit(embedding)
+        chunk_ids = tuple(chunk_ids)
+
+        with self._lock:
+            self._drop_expired()
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            similarities = self._stacked() @ query
+            ids = self._matrix_ids
+            context_mismatch = False
+
+            for i in np.argsort(-similarities):
+                similarity = min(float(similarities[i]), 1.0)
+                if similarity < self.threshold:
+                    break
+
+                entry = self._entries[ids[i]]
+                if entry["chunk_ids"] != chunk_ids or entry["context"] != context:
+                    context_mismatch = True
+                    continue
+
+                self._entries.move_to_end(ids[i])
+                entry["hits"] += 1
+                self.hits += 1
+                self._hit_similarity += similarity
+                self.last_hit = {"question": entry["question"], "similarity": similarity, "hits": entry["hits"]}
+                return {
+                    "answer": entry["answer"],
+                    "sources": list(entry["sources"]),
+                    "question": entry["question"],
+                    "similarity": similarity,
+                }
+
+            self.misses += 1
+            self.context_mismatches += context_mismatch
+            return None
+
+    def store(
+        self,
+        question: str,
+        embedding: list[float],
+        chunk_ids: list[str],
+        answer: str,
+        sources: list[str],
+        context: tuple = (),
+    ):
+        """Memorizza una risposta, eliminando le meno recenti oltre il limite."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[self._next_id] = {
+                "question": question,
+                "vector": _unit(embedding),
+                "chunk_ids": tuple(chunk_ids),
+                "context": context,
+                "answer": answer,
+                "sources": list(sources),
+                "created": time.monotonic(),
+                "hits": 0,
+            }
+            self._next_id += 1
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        """Svuota la cache."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        """Restituisce numero di voci, contatori hit/miss e similarità media dei riusi."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "context_mismatches": self.context_mismatches,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "mean_hit_similarity": self._hit_similarity / self.hits if self.hits else 0.0,
+        }
+
+    def _stacked(self) -> np.ndarray:
+        """Matrice dei vettori delle domande in cache (ricostruita solo dopo inserimenti o eliminazioni)."""
+        if self._matrix is None:
+            self._matrix_ids = list(self._entries)
+            self._matrix = np.stack([self._entries[key]["vector"] for key in self._matrix_ids])
+        return self._matrix
+
+    def _drop_expired(self):
+        if self.ttl <= 0:
+            return
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+
+def _unit(embedding: list[float]) -> np.ndarray:
+    """Vettore float32 a norma unitaria."""
+    return normalize_rows(np.asarray(embedding, dtype=np.float32)[None, :])[0]
@@ -3,20 +3,67 @@ RAG Pipeline - Orchestrazione completa del sistema RAG
 """
 
 import os
-from typing import Optional
+import random
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Optional
 
 from openai import OpenAI
 
-from .loaders import load_directory
-from .chunker import chunk_documents
-from .embedder import Embedder
+from .loaders import (
+    DEFAULT_LOAD_TIMEOUT,
+    DEFAULT_LOAD_WORKERS,
+    document_path,
+    file_fingerprint,
+    iter_load_files,
+    list_documents,
+    print_load_summary,
+)
+from .chunker import DEFAULT_CHUNK_WORKERS, chunk_document, get_tokenizer
+from .embedder import BaseEmbedder, create_embedder, merge_batch_stats
 from .mongodb_client import MongoDBClient
+from .query_cache import AnswerCache, QueryCache, search_key
+from .stages import Stage, format_stage_stats, run_stages
 
 
 DEFAULT_CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
 DEFAULT_TEMPERATURE = float(os.getenv("TEMPERATURE", "0.3"))
 DEFAULT_TOP_K = int(os.getenv("TOP_K", "5"))
 
+# Chunk per batch di embedding e scrittura nell'ingest a stadi
+DEFAULT_INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "512"))
+
+# Documenti caricati in attesa di chunking (limita la memoria quando il chunking è più lento)
+_DOCUMENT_QUEUE_SIZE = 16
+
+
+def _sample(items: Iterable, size: int, seed: int = 0) -> list:
+    """
+    Campione uniforme di al massimo size elementi, in un solo passaggio (reservoir sampling).
+
+    Args:
+        items: Elementi (anche un generatore)
+        size: Elementi massimi del campione (0 = tutti)
+        seed: Seme del generatore casuale (campione riproducibile)
+
+    Returns:
+        Gli elementi campionati
+    """
+    if size <= 0:
+        return list(items)
+
+    rng = random.Random(seed)
+    sample = []
+    for seen, item in enumerate(items):
+        if seen < size:
+            sample.append(item)
+        else:
+            slot = rng.randrange(seen + 1)
+            if slot < size:
+                sample[slot] = item
+    return sample
+
 
 class RAGPipeline:
     """Pipeline completa per il sistema RAG."""
@@ -24,26 +71,34 @@ class RAGPipeline:
     def __init__(
         self,
         mongodb_client: Optional[MongoDBClient] = None,
-        embedder: Optional[Embedder] = None,
+        embedder: Optional[BaseEmbedder] = None,
         chat_model: str = DEFAULT_CHAT_MODEL,
         temperature: float = DEFAULT_TEMPERATURE,
+        query_cache: Optional[QueryCache] = None,
+        answer_cache: Optional[AnswerCache] = None,
     ):
         """
         Inizializza la pipeline RAG.
 
         Args:
             mongodb_client: Client MongoDB (default: crea nuovo)
-            embedder: Embedder per i vettori (default: crea nuovo)
+            embedder: Backend di embedding (default: da EMBEDDING_MODEL)
             chat_model: Modello per le risposte
             temperature: Temperatura del modello
+            query_cache: Cache delle query (default: crea nuova, configurata da env)
+            answer_cache: Cache semantica delle risposte (default: crea nuova, configurata da env)
         """
         self.mongodb_client = mongodb_client or MongoDBClient()
-        self.embedder = embedder or Embedder()
+        self.embedder = embedder or create_embedder()
         self.chat_model = chat_model
         self.temperature = temperature
+        self.query_cache = query_cache or QueryCache()
+        self.answer_cache = answer_cache or AnswerCache()
+        self._model_version = self.embedder.model_version
 
-        api_key = os.getenv("OPENAI_API_KEY")
-        self.openai_client = OpenAI(api_key=api_key)
+        # Client di chat creato alla prima risposta: indicizzazione e ricerca con
+        # EMBEDDING_MODEL=local non richiedono credenziali OpenAI
+        self.openai_client: Optional[OpenAI] = None
 
     def ingest(
         self,
@@ -51,94 +106,510 @@ class RAGPipeline:
         chunk_size: int = 500,
         overlap: int = 50,
         clear_existing: bool = False,
+        embedding_concurrency: Optional[int] = None,
+        chunk_workers: int = DEFAULT_CHUNK_WORKERS,
+        incremental: bool = False,
+        load_workers: int = DEFAULT_LOAD_WORKERS,
+        load_timeout: float = DEFAULT_LOAD_TIMEOUT,
+        batch_size: int = DEFAULT_INGEST_BATCH_SIZE,
+        resume_run: Optional[str] = None,
     ) -> dict:
         """
         Pipeline completa di indicizzazione: load → chunk → embed → store.
 
+        Ogni indicizzazione è una run registrata su MongoDB con i suoi parametri
+        e l'avanzamento: i chunk sono salvati a batch man mano che gli embedding
+        sono pronti, quindi se la run si interrompe il lavoro già salvato resta.
+        Riprendendola (resume_run, oppure resume()) i chunk già presenti nella
+        collection non vengono né ricalcolati né riscritti.
+
+        Gli stadi girano in parallelo, collegati da code limitate: i documenti
+        scorrono a batch di batch_size chunk senza materializzare il corpus, quindi
+        la memoria non cresce con il numero di documenti e il caricamento dei file
+        procede mentre i batch precedenti sono in embedding o in scrittura.
+
+        Ogni file indicizzato viene registrato nel manifest (dimensione, mtime,
+        hash) e i chunk non più prodotti da un file reindicizzato vengono
+        eliminati. Con incremental=True sono elaborati solo i file nuovi o
+        modificati rispetto al manifest, e i chunk dei file rimossi dalla
+        cartella vengono eliminati.
+
         Args:
             directory: Cartella con i documenti
             chunk_size: Token per chunk
             overlap: Token di overlap
             clear_existing: Se True, elimina i dati esistenti prima
+            embedding_concurrency: Richieste di embedding in parallelo (default: dell'Embedder)
+            chunk_workers: Thread di tokenizzazione (0 = uno per core)
+            incremental: Se True, elabora solo i file cambiati dall'ultima indicizzazione
+            load_workers: Processi di caricamento dei file (0 = uno per core)
+            load_timeout: Secondi massimi per file (0 = nessun limite)
+            batch_size: Chunk per batch di embedding e scrittura
+            resume_run: Id di una run interrotta da riprendere (non elimina i dati esistenti)
 
         Returns:
-            Statistiche sull'operazione
+            Statistiche sull'operazione, con l'id della run in 'run_id'
+        """
+        params = {
+            "directory": directory,
+            "chunk_size": chunk_size,
+            "overlap": overlap,
+            "embedding_concurrency": embedding_concurrency,
+            "chunk_workers": chunk_workers,
+            "incremental": incremental,
+            "load_workers": load_workers,
+            "load_timeout": load_timeout,
+            "batch_size": batch_size,
+        }
+        if resume_run:
+            run_id = resume_run
+            self.mongodb_client.resume_run(run_id)
+            print(f"Ripresa run: {run_id}")
+        else:
+            run_id = self.mongodb_client.start_run(params)
+            print(f"Run: {run_id}")
+
+        try:
+            result = self._ingest(
+                **params,
+                clear_existing=clear_existing and not resume_run,
+                run_id=run_id,
+                resuming=bool(resume_run),
+            )
+        except BaseException as e:
+            # Anche con Ctrl+C: la run resta riprendibile
+            self.mongodb_client.finish_run(run_id, "failed", str(e) or type(e).__name__)
+            print(f"Run {run_id} interrotta. Per riprenderla: python main.py ingest --resume {run_id}")
+            raise
+
+        self.mongodb_client.finish_run(run_id, "completed")
+        return {"run_id": run_id, **result}
+
+    def resume(self, run_id: str) -> dict:
         """
+        Riprende una run di indicizzazione interrotta, con i parametri originali.
+
+        Args:
+            run_id: Id della run
+
+        Returns:
+            Statistiche sull'operazione (vedi ingest)
+        """
+        run = self.mongodb_client.get_run(run_id)
+        if run is None:
+            raise ValueError(f"Run di indicizzazione non trovata: {run_id}")
+        if run["status"] == "completed":
+            raise ValueError(f"La run {run_id} è già completata")
+
+        print(f"Chunk già salvati dalla run: {run['chunks_stored']} ({run['batches']} batch)")
+        return self.ingest(**run["params"], resume_run=run_id)
+
+    def _ingest(
+        self,
+        directory: str,
+        chunk_size: int,
+        overlap: int,
+        clear_existing: bool,
+        embedding_concurrency: Optional[int],
+        chunk_workers: int,
+        incremental: bool,
+        load_workers: int,
+        load_timeout: float,
+        batch_size: int,
+        run_id: str,
+        resuming: bool,
+    ) -> dict:
+        """Esegue una run di indicizzazione (vedi ingest)."""
         if clear_existing:
             deleted = self.mongodb_client.delete_all()
+            self._reset_model()
             print(f"  Eliminati {deleted} chunk esistenti")
 
         print(f"Caricamento documenti da: {directory}")
-        documents = load_directory(directory)
-        print(f"  Caricati {len(documents)} documenti")
-
-        if not documents:
-            return {"documents": 0, "chunks": 0, "status": "no_documents"}
+        paths = list_documents(directory)
+        unchanged = removed = []
+        if incremental and not clear_existing:
+            paths, unchanged, removed = self._changed_files(directory, paths)
+            print(f"  File nuovi o modificati: {len(paths)}, invariati: {len(unchanged)}, rimossi: {len(removed)}")
+
+        removed_chunks = 0
+        if removed:
+            removed_chunks = self.mongodb_client.delete_by_source(removed)
+            self.mongodb_client.delete_manifest(removed)
+            self.query_cache.invalidate()
+            print(f"  Eliminati {removed_chunks} chunk di file rimossi")
+
+        tokenizer = get_tokenizer()
+        if paths and not self.embedder.fitted:
+            # Il modello locale va adattato al corpus prima di generare embeddings:
+            # un campione uniforme di chunk, così la memoria non cresce con il corpus
+            print("Adattamento modello di embedding (primo passaggio sui documenti)...")
+            texts = _sample(
+                (
+                    chunk["text"]
+                    for doc in iter_load_files(paths, load_workers, load_timeout)
+                    for chunk in chunk_document(doc, chunk_size, overlap, tokenizer=tokenizer)
+                ),
+                self.embedder.fit_chunks,
+            )
+            if texts:
+                print(f"  Adattamento su {len(texts)} chunk")
+                self.embedder.fit(texts)
+
+        print("Indicizzazione: load → chunk → embed → store")
+        lock = threading.Lock()
+        progress = {"documents": 0, "chunks": 0, "stored": 0, "inserted": 0, "resumed": 0, "write_seconds": 0.0}
+        write_errors: dict[str, str] = {}
+        # Solo contatori per file: i chunk obsoleti si riconoscono dalla run che li ha scritti
+        file_chunks: dict[str, int] = defaultdict(int)
+        # Impronta di ogni file presa dal loader quando lo ha letto: è quella dei chunk salvati
+        fingerprints: dict[str, dict] = {}
+        # File con chunk rifiutati da MongoDB
+        rejected: set[str] = set()
+        batch_stats = []
+
+        def chunk_stage(doc: dict) -> list[dict]:
+            chunks = chunk_document(doc, chunk_size, overlap, tokenizer=tokenizer)
+            with lock:
+                progress["documents"] += 1
+                progress["chunks"] += len(chunks)
+                file_chunks[document_path(doc)] += len(chunks)
+                fingerprints.setdefault(document_path(doc), doc["fingerprint"])
+            return chunks
+
+        def embed_stage(chunks: list[dict]) -> list[dict]:
+            if resuming:
+                # Chunk già salvati prima dell'interruzione: niente embedding né scrittura
+                saved = self.mongodb_client.existing_chunk_ids([chunk["chunk_id"] for chunk in chunks], run_id=run_id)
+                chunks = [chunk for chunk in chunks if chunk["chunk_id"] not in saved]
+                with lock:
+                    progress["resumed"] += len(saved)
+                if not chunks:
+                    return []
+            # Le richieste in parallelo sono i worker dello stadio: una alla volta per batch
+            stats = {}
+            chunks = self.embedder.embed_chunks(chunks, max_concurrency=1, stats=stats)
+            with lock:
+                batch_stats.append(stats)
+            return chunks
+
+        def store_stage(chunks: list[dict]):
+            inserted = self.mongodb_client.insert_chunks(chunks, run_id=run_id)
+            write_stats = self.mongodb_client.last_write_stats
+            write_errors.update(write_stats["errors"])
+            rejected.update(chunk["metadata"]["path"] for chunk in chunks if chunk["chunk_id"] in write_stats["errors"])
+            self.mongodb_client.record_run_batch(run_id, write_stats["documents"], inserted)
+            progress["inserted"] += inserted
+            progress["stored"] += write_stats["documents"]
+            progress["write_seconds"] += write_stats["seconds"]
+            print(f"  Salvati {progress['stored']} chunk ({progress['inserted']} nuovi)")
+
+        # Un batch di chunk per worker: EMBEDDING_CONCURRENCY richieste in volo durante l'ingest
+        embed_workers = embedding_concurrency or self.embedder.max_concurrency
+        load_summary = {}
+        cache_before = self.embedder.cache_stats()
+        stage_stats = run_stages(
+            iter_load_files(paths, load_workers, load_timeout, load_summary, fingerprint=True),
+            [
+                Stage("chunk", chunk_stage, workers=chunk_workers or os.cpu_count() or 1, queue_size=2 * batch_size),
+                Stage("embed", embed_stage, workers=embed_workers, batch_size=batch_size, queue_size=2 * batch_size),
+                Stage("store", store_stage, batch_size=batch_size),
+            ],
+            source_name="load",
+            source_queue_size=_DOCUMENT_QUEUE_SIZE,
+        )
+        if progress["stored"]:
+            self.query_cache.invalidate()
+        self._check_model_version()
+
+        print_load_summary(load_summary)
+        load_stats = {
+            "seconds": load_summary["seconds"],
+            "failed": [path for path, _ in load_summary["failed"]],
+            "slow": [path for path, _ in load_summary["slow"]],
+        }
 
-        print("Creazione chunk...")
-        chunks = chunk_documents(documents, chunk_size, overlap)
-        print(f"  Creati {len(chunks)} chunk")
+        if not progress["documents"]:
+            status = "up_to_date" if incremental and not paths else "no_documents"
+            return {
+                "documents": 0,
+                "chunks": 0,
+                "unchanged": len(unchanged),
+                "removed": len(removed),
+                "removed_chunks": removed_chunks,
+                "load": load_stats,
+                "status": status,
+            }
 
-        print("Generazione embeddings...")
-        chunks = self.embedder.embed_chunks(chunks)
-        print(f"  Generati {len(chunks)} embeddings")
+        print("Throughput per stadio:")
+        for line in format_stage_stats(stage_stats):
+            print(f"  {line}")
 
-        print("Salvataggio in MongoDB...")
-        inserted = self.mongodb_client.insert_chunks(chunks)
-        print(f"  Inseriti {inserted} chunk")
+        cache_stats = None
+        cache_after = self.embedder.cache_stats()
+        if cache_after:
+            cache_stats = {
+                "hits": cache_after["hits"] - cache_before["hits"],
+                "misses": cache_after["misses"] - cache_before["misses"],
+            }
+            print(f"  Cache embeddings: {cache_stats['hits']} hit, {cache_stats['misses']} miss")
+
+        batch_stats = merge_batch_stats(batch_stats)
+        if batch_stats:
+            print(
+                f"  Richieste embeddings: {batch_stats['batches']} "
+                f"(testi/batch {batch_stats['items']['min']}-{batch_stats['items']['max']}, "
+                f"token/batch medi {batch_stats['tokens']['mean']:.0f}, troncati {batch_stats['truncated']})"
+            )
+        write_stats = {
+            "documents": progress["stored"],
+            "seconds": progress["write_seconds"],
+            "docs_per_second": progress["stored"] / progress["write_seconds"] if progress["write_seconds"] else 0.0,
+            "errors": len(write_errors),
+        }
+        if progress["stored"]:
+            print(
+                f"  Scrittura MongoDB: {progress['stored']} documenti in {progress['write_seconds']:.1f}s "
+                f"({write_stats['docs_per_second']:.0f} doc/s, batch da {self.mongodb_client.write_batch_size}, "
+                f"{self.mongodb_client.write_workers} thread)"
+            )
+        if write_errors:
+            print(f"  Chunk rifiutati da MongoDB: {len(write_errors)} (es. {next(iter(write_errors.values()))})")
+        if progress["resumed"]:
+            print(f"  Chunk già salvati prima della ripresa: {progress['resumed']}")
+        already_present = progress["chunks"] - progress["inserted"] - progress["resumed"] - len(write_errors)
+        print(f"  Inseriti {progress['inserted']} chunk nuovi ({already_present} già presenti)")
+
+        # I file con errori (record interrotti o chunk rifiutati) sono stati letti solo in parte:
+        # restano fuori dal manifest e conservano i chunk precedenti, verranno riletti
+        incomplete = set(load_stats["failed"]) | rejected
+        files = [path for path in file_chunks if path not in incomplete]
+
+        # I chunk delle versioni precedenti dei file reindicizzati (non riscritti da questa run) non servono più
+        stale = self.mongodb_client.delete_by_source(files, except_run=run_id)
+        if stale:
+            print(f"  Eliminati {stale} chunk obsoleti")
+            self.query_cache.invalidate()
+
+        self.mongodb_client.update_manifest({
+            path: {**fingerprints[path], "chunks": file_chunks[path]}
+            for path in files
+        })
 
         return {
-            "documents": len(documents),
-            "chunks": len(chunks),
-            "inserted": inserted,
+            "documents": progress["documents"],
+            "files": len(files),
+            "chunks": progress["chunks"],
+            "inserted": progress["inserted"],
+            "resumed_chunks": progress["resumed"],
+            "stale_chunks": stale,
+            "unchanged": len(unchanged),
+            "removed": len(removed),
+            "removed_chunks": removed_chunks,
+            "load": load_stats,
+            "embedding_cache": cache_stats,
+            "embedding_batches": batch_stats,
+            "writes": write_stats,
+            "stages": stage_stats,
             "status": "success",
         }
 
+    def _changed_files(self, directory: str, paths: list[str]) -> tuple[list[str], list[str], list[str]]:
+        """
+        Confronta i file della cartella con il manifest.
+
+        Dimensione e mtime invariati: file invariato, senza leggerlo. Altrimenti
+        si confronta l'hash del contenuto (un file solo "toccato" resta invariato
+        e il manifest viene aggiornato).
+
+        Returns:
+            (file nuovi o modificati, file invariati, fonti del manifest non più presenti)
+        """
+        manifest = self.mongodb_client.get_manifest()
+        changed, unchanged = [], []
+        touched = {}
+
+        for path in paths:
+            entry = manifest.get(path)
+            fingerprint = file_fingerprint(path)
+            if entry and entry["size"] == fingerprint["size"] and entry["mtime"] == fingerprint["mtime"]:
+                unchanged.append(path)
+                continue
+
+            fingerprint = file_fingerprint(path, content_hash=True)
+            if entry and entry["sha256"] == fingerprint["sha256"]:
+                unchanged.append(path)
+                touched[path] = {**fingerprint, "chunks": entry.get("chunks", 0)}
+            else:
+                changed.append(path)
+
+        self.mongodb_client.update_manifest(touched)
+
+        # Solo le fonti sotto la cartella indicizzata: il manifest può contenere altre cartelle
+        root = Path(directory)
+        present = set(paths)
+        removed = [
+            source for source in manifest
+            if source not in present and Path(source).is_relative_to(root)
+        ]
+        return changed, unchanged, removed
+
     def query(
         self,
         question: str,
         k: int = DEFAULT_TOP_K,
         return_sources: bool = True,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Optional[dict] = None,
     ) -> dict:
         """
         Esegue una query RAG: cerca contesto e genera risposta.
 
+        Embedding della domanda e risultati della ricerca vengono riutilizzati
+        dalla cache delle query finché la collection non cambia.
+
         Args:
             question: La domanda dell'utente
             k: Numero di chunk da recuperare
             return_sources: Se includere le fonti nella risposta
+            nprobe: Liste IVF da esaminare (solo con indice approssimato)
+            exact: Se True, forza la ricerca esatta
+            filters: Filtri sui chunk ("source", "type", "path_prefix")
 
         Returns:
             Dizionario con risposta, fonti e chunk usati
         """
-        query_embedding = self.embedder.get_embedding(question)
+        self._check_model_version()
+        query_embedding, results = None, None
+        if self.query_cache.enabled:
+            key = search_key(k, nprobe, exact, filters)
+            version = self.mongodb_client.get_index_version()
+            query_embedding, results = self.query_cache.lookup(question, key, version)
+
+        if results is None:
+            if query_embedding is None:
+                query_embedding = self.embedder.get_embedding(question)
+
+            results = self.mongodb_client.vector_search(
+                query_embedding,
+                k=k,
+                nprobe=nprobe,
+                exact=exact,
+                filters=filters,
+            )
+            if self.query_cache.enabled:
+                self.query_cache.store(question, key, version, query_embedding, results)
+
+        return self._answer(question, results, return_sources, query_embedding)
+
+    def query_batch(
+        self,
+        questions: list[str],
+        k: int = DEFAULT_TOP_K,
+        return_sources: bool = True,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Optional[dict] = None,
+    ) -> list[dict]:
+        """
+        Esegue più query RAG: un'unica chiamata embeddings e un'unica ricerca batch.
+
+        Args:
+            questions: Le domande
+            k: Numero di chunk da recuperare per domanda
+            return_sources: Se includere le fonti nelle risposte
+            nprobe: Liste IVF da esaminare (solo con indice approssimato)
+            exact: Se True, forza la ricerca esatta
+            filters: Filtri sui chunk, comuni a tutte le domande
+
+        Returns:
+            Una risposta (come query) per ogni domanda, nello stesso ordine
+        """
+        if not questions:
+            return []
+
+        self._check_model_version()
+        query_embeddings = self.embedder.get_embeddings_batch(questions)
+
+        results_per_question = self.mongodb_client.vector_search_batch(
+            query_embeddings,
+            k=k,
+            nprobe=nprobe,
+            exact=exact,
+            filters=filters,
+        )
+
+        return [
+            self._answer(question, results, return_sources, query_embedding)
+            for question, results, query_embedding in zip(questions, results_per_question, query_embeddings)
+        ]
+
+    def _answer(
+        self,
+        question: str,
+        results: list[dict],
+        return_sources: bool,
+        query_embedding: Optional[list[float]] = None,
+    ) -> dict:
+        """
+        Genera la risposta a partire dai chunk recuperati.
 
-        results = self.mongodb_client.vector_search(query_embedding, k=k)
+        Se una domanda simile con gli stessi chunk è nella cache semantica,
+        la risposta memorizzata viene restituita senza chiamare il modello.
 
+        Args:
+            question: La domanda dell'utente
+            results: I chunk recuperati dalla ricerca
+            return_sources: Se includere le fonti nella risposta
+            query_embedding: Embedding della domanda (abilita la cache semantica)
+
+        Returns:
+            Dizionario con risposta, fonti, chunk usati e l'eventuale riuso
+            dalla cache ('answer_cache': domanda in cache e similarità, oppure None)
+        """
         if not results:
             return {
                 "answer": "Non ho trovato informazioni rilevanti nella knowledge base per rispondere a questa domanda.",
                 "sources": [],
                 "chunks": [],
+                "answer_cache": None,
             }
 
+        use_cache = query_embedding is not None and self.answer_cache.enabled
+        chunk_ids = [r.get("chunk_id") for r in results]
+        context = (self.chat_model, self.temperature)
+
+        if use_cache:
+            cached = self.answer_cache.lookup(query_embedding, chunk_ids, context)
+            if cached:
+                return {
+                    "answer": cached["answer"],
+                    "sources": cached["sources"] if return_sources else [],
+                    "chunks": results,
+                    "answer_cache": {"question": cached["question"], "similarity": cached["similarity"]},
+                }
+
         prompt = self._build_prompt(question, results)
 
         response = self._generate_response(prompt)
 
         sources = []
-        if return_sources:
-            seen_sources = set()
-            for r in results:
-                source = r.get("source", "Sconosciuto")
-                if source not in seen_sources:
-                    sources.append(source)
-                    seen_sources.add(source)
+        seen_sources = set()
+        for r in results:
+            source = r.get("source", "Sconosciuto")
+            if source not in seen_sources:
+                sources.append(source)
+                seen_sources.add(source)
+
+        if use_cache:
+            self.answer_cache.store(question, query_embedding, chunk_ids, response, sources, context)
 
         return {
             "answer": response,
-            "sources": sources,
+            "sources": sources if return_sources else [],
             "chunks": results,
+            "answer_cache": None,
         }
 
     def _build_prompt(self, question: str, context_chunks: list[dict]) -> list[dict]:
@@ -192,6 +663,9 @@ Domanda: {question}"""
         Returns:
             Risposta generata dal modello
         """
+        if self.openai_client is None:
+            self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
         response = self.openai_client.chat.completions.create(
             model=self.chat_model,
             messages=messages,
@@ -204,6 +678,35 @@ Domanda: {question}"""
         """Restituisce statistiche del database."""
         return self.mongodb_client.get_stats()
 
+    def get_cache_stats(self) -> dict:
+        """Restituisce le statistiche della cache delle query."""
+        return self.query_cache.stats()
+
+    def get_answer_cache_stats(self) -> dict:
+        """Restituisce le statistiche della cache semantica delle risposte."""
+        return self.answer_cache.stats()
+
     def clear(self) -> int:
         """Elimina tutti i dati dal database."""
-        return self.mongodb_client.delete_all()
+        deleted = self.mongodb_client.delete_all()
+        self._reset_model()
+        return deleted
+
+    def _reset_model(self):
+        """Scarta il modello adattato al corpus e le cache che contengono i suoi embedding."""
+        self.embedder.reset_model()
+        self.query_cache.clear()
+        self.answer_cache.clear()
+        self._model_version = self.embedder.model_version
+
+    def _check_model_version(self):
+        """
+        Svuota le cache delle query e delle risposte se il modello di embedding è
+        cambiato (riadattato da questo o da un altro processo): gli embedding delle
+        domande in cache appartengono allo spazio precedente.
+        """
+        version = self.embedder.model_version
+        if version != self._model_version:
+            self.query_cache.clear()
+            self.answer_cache.clear()
+            self._model_version = version
@@ -0,0 +1,213 @@
+"""
+Stages - Pipeline a stadi concorrenti collegati da code limitate
+Ogni stadio gira nei propri thread; le code piene rallentano gli stadi a monte,
+così la memoria resta limitata qualunque sia la dimensione dell'input
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Iterable
+
+
+# Attesa massima su una coda prima di ricontrollare se la pipeline è stata interrotta
+_POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class Stage:
+    """Uno stadio della pipeline."""
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1, batch_size: int = 0, queue_size: int = 1024):
+        """
+        Definisce lo stadio.
+
+        Args:
+            name: Nome nelle statistiche
+            fn: Funzione che riceve un elemento (una lista se batch_size > 0) e
+                restituisce gli elementi per lo stadio successivo (None se non ce ne sono)
+            workers: Thread dello stadio
+            batch_size: Elementi raccolti per chiamata di fn (0 = uno alla volta)
+            queue_size: Elementi massimi in attesa all'uscita dello stadio
+        """
+        self.name = name
+        self.fn = fn
+        self.workers = max(workers, 1)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+
+class _StageStats:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items: int, seconds: float):
+        with self.lock:
+            self.items += items
+            self.busy += seconds
+
+    def as_dict(self) -> dict:
+        # Capacità: elementi al secondo di lavoro effettivo, con tutti i worker dello stadio
+        seconds = self.busy / self.workers
+        return {
+            "items": self.items,
+            "workers": self.workers,
+            "busy_seconds": self.busy,
+            "per_second": self.items / seconds if seconds > 0 else 0.0,
+        }
+
+
+def run_stages(source: Iterable, stages: list[Stage], source_name: str = "source", source_queue_size: int = 64) -> dict:
+    """
+    Esegue una pipeline: un thread legge la sorgente, ogni stadio consuma la
+    coda a monte e riempie quella a valle.
+
+    Gli stadi girano in parallelo. Un errore in uno stadio ferma quello stadio
+    e tutti quelli a monte, mentre gli stadi a valle completano gli elementi già
+    in coda (es. i batch con embedding già calcolati vengono comunque salvati);
+    poi l'errore viene rilanciato al chiamante.
+
+    Args:
+        source: Elementi in ingresso (iterati in un thread dedicato)
+        stages: Stadi, in ordine
+        source_name: Nome dello stadio sorgente nelle statistiche
+        source_queue_size: Elementi massimi in attesa dopo la sorgente
+
+    Returns:
+        Statistiche per stadio ('items', 'workers', 'busy_seconds', 'per_second')
+        e durata totale in 'seconds'
+    """
+    queues = [queue.Queue(maxsize=source_queue_size)]
+    queues += [queue.Queue(maxsize=stage.queue_size) for stage in stages[:-1]]
+    stats = {source_name: _StageStats(1), **{stage.name: _StageStats(stage.workers) for stage in stages}}
+    errors = []
+
+    # Stadi fermati da un errore: tutti quelli in posizione <= halted[0] (la sorgente è -1)
+    halted = [-2]
+    halted_lock = threading.Lock()
+
+    def is_halted(position: int) -> bool:
+        return position <= halted[0]
+
+    def put(position: int, item) -> bool:
+        """Accoda un elemento per lo stadio in posizione position, finché quello stadio è attivo."""
+        while not is_halted(position):
+            try:
+                queues[position].put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(position: int):
+        while not is_halted(position):
+            try:
+                return queues[position].get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def fail(position: int, error: BaseException):
+        with halted_lock:
+            errors.append(error)
+            halted[0] = max(halted[0], position)
+
+    def read_source():
+        iterator = iter(source)
+        try:
+            while not is_halted(-1):
+                start = time.perf_counter()
+                item = next(iterator, _DONE)
+                stats[source_name].add(item is not _DONE, time.perf_counter() - start)
+                if item is _DONE or not put(0, item):
+                    break
+        except Exception as e:
+            fail(-1, e)
+        finally:
+            # Chiude i generatori (es. il pool di caricamento) anche se la pipeline è interrotta
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+            for _ in range(stages[0].workers):
+                put(0, _DONE)
+
+    remaining = [stage.workers for stage in stages]
+    remaining_lock = threading.Lock()
+
+    def run_worker(position: int):
+        stage = stages[position]
+        has_next = position + 1 < len(stages)
+
+        try:
+            done = False
+            while not done and not is_halted(position):
+                if stage.batch_size:
+                    item = []
+                    while len(item) < stage.batch_size:
+                        element = get(position)
+                        if element is _DONE:
+                            done = True
+                            break
+                        item.append(element)
+                    if not item:
+                        break
+                else:
+                    item = get(position)
+                    if item is _DONE:
+                        break
+
+                start = time.perf_counter()
+                outputs = stage.fn(item) or []
+                stats[stage.name].add(len(item) if stage.batch_size else 1, time.perf_counter() - start)
+
+                if has_next:
+                    for output in outputs:
+                        if not put(position + 1, output):
+                            break
+        except Exception as e:
+            fail(position, e)
+        finally:
+            # L'ultimo worker dello stadio segnala la fine allo stadio successivo
+            with remaining_lock:
+                remaining[position] -= 1
+                last = remaining[position] == 0
+            if last and has_next:
+                for _ in range(stages[position + 1].workers):
+                    put(position + 1, _DONE)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=read_source, name=f"stage-{source_name}", daemon=True)]
+    for position, stage in enumerate(stages):
+        threads += [
+            threading.Thread(target=run_worker, args=(position,), name=f"stage-{stage.name}-{i}", daemon=True)
+            for i in range(stage.workers)
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    result = {name: stage_stats.as_dict() for name, stage_stats in stats.items()}
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def format_stage_stats(stats: dict) -> list[str]:
+    """Righe di riepilogo della pipeline: elementi, tempo di lavoro e capacità di ogni stadio."""
+    lines = []
+    for name, stage in stats.items():
+        if name == "seconds":
+            continue
+        lines.append(
+            f"{name}: {stage['items']} elementi, {stage['busy_seconds']:.1f}s di lavoro "
+            f"({stage['workers']} worker, {stage['per_second']:.1f}/s)"
+        )
+    lines.append(f"totale: {stats['seconds']:.1f}s")
+    return lines
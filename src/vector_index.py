@@ -0,0 +1,770 @@
+"""
+Vector Index - Indice vettoriale in memoria basato su NumPy
+Matrice contigua di embedding normalizzati (float32 o quantizzati int8) + array di chunk_id.
+Ricerca esatta (brute force) oppure approssimata IVF (centroidi + liste invertite).
+"""
+
+import math
+import os
+import time
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+
+DEFAULT_INDEX_TYPE = os.getenv("VECTOR_INDEX", "exact")
+DEFAULT_IVF_LISTS = int(os.getenv("IVF_LISTS", "0"))
+DEFAULT_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+DEFAULT_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+DEFAULT_RESCORE = int(os.getenv("RESCORE_CANDIDATES", "200"))
+DEFAULT_PREFIX_DIM = int(os.getenv("VECTOR_PREFIX_DIM", "0"))
+
+# Righe elaborate per blocco nei prodotti matriciali (limita la memoria temporanea)
+_BLOCK_ROWS = 65536
+
+# Frazione di righe filtrate oltre la quale conviene valutare tutta la matrice invece di estrarre le righe
+_DENSE_FILTER_FRACTION = 0.5
+
+# Massimo numero di score (righe x query) calcolati insieme nella ricerca batch
+_BATCH_SCORE_ELEMENTS = 32 * 1024 * 1024
+
+# Funzione che restituisce gli embedding a precisione piena per i chunk_id richiesti
+VectorLoader = Callable[[list[str]], dict[str, list[float]]]
+
+# Campi per cui l'indice mantiene le liste di righe per valore (filtri pre-scoring);
+# "path" è il file di origine, diverso da "source" per i record dei file JSONL/array JSON ("percorso#riga")
+FILTER_FIELDS = ("source", "type", "path")
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Normalizza le righe di una matrice a norma unitaria (le righe nulle restano nulle)."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _as_matrix(embeddings) -> np.ndarray:
+    """Matrice float32 degli embedding (senza copia se è già un array float32)."""
+    if isinstance(embeddings, np.ndarray):
+        return np.asarray(embeddings, dtype=np.float32)
+    return np.asarray(list(embeddings), dtype=np.float32)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Restituisce gli indici dei k punteggi più alti, in ordine decrescente."""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _union(parts: list[np.ndarray]) -> np.ndarray:
+    """Unione ordinata di liste di righe (ciascuna già ordinata e senza duplicati)."""
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return np.empty(0, dtype=np.int64)
+    if len(parts) == 1:
+        return parts[0]
+    return np.unique(np.concatenate(parts))
+
+
+class VectorIndex:
+    """
+    Indice esatto: un prodotto matrice-vettore per query, top-k con argpartition.
+
+    Con quantization="int8" i vettori sono memorizzati come codici int8 con una scala
+    per dimensione (4x meno memoria di float32): il primo passaggio scansiona i codici
+    e, se è disponibile un vector_loader, i migliori `rescore` candidati vengono
+    ricalcolati con gli embedding a precisione piena.
+
+    Con prefix_dim > 0 (embedding Matryoshka, es. text-embedding-3) l'indice
+    memorizza solo le prime prefix_dim dimensioni, rinormalizzate: il primo
+    passaggio è più veloce e leggero in proporzione, e la shortlist viene
+    ricalcolata allo stesso modo con i vettori completi.
+    """
+
+    def __init__(
+        self,
+        quantization: str = DEFAULT_QUANTIZATION,
+        rescore: int = DEFAULT_RESCORE,
+        vector_loader: Optional[VectorLoader] = None,
+        prefix_dim: int = DEFAULT_PREFIX_DIM,
+    ):
+        """
+        Inizializza un indice vuoto.
+
+        Args:
+            quantization: "none" (float32) oppure "int8"
+            rescore: Candidati ricalcolati a precisione piena (con quantizzazione o prefix_dim)
+            vector_loader: Funzione che fornisce gli embedding originali per il rescoring
+            prefix_dim: Dimensioni memorizzate per il primo passaggio (0 = tutte)
+        """
+        if quantization not in ("none", "int8"):
+            raise ValueError(f"Quantizzazione non supportata: {quantization}")
+
+        self.quantization = quantization
+        self.rescore = rescore
+        self.vector_loader = vector_loader
+        self.prefix_dim = prefix_dim
+
+        # Dimensione degli embedding in ingresso (e delle query), fissata dal build
+        self.input_dim = 0
+
+        # Buffer con capacità oltre le righe usate (_size): add aggiunge righe in tempo
+        # ammortizzato costante invece di ricopiare la matrice a ogni batch
+        self._chunk_ids = np.empty(0, dtype=object)
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._size = 0
+        self.scale: Optional[np.ndarray] = None
+
+        # Righe non cancellate (le cancellazioni sono tombstone, escluse dai risultati)
+        self._alive = np.empty(0, dtype=bool)
+
+        # Righe presenti all'ultimo build
+        self.built_rows = 0
+
+        # campo -> valore -> righe con quel valore
+        self.postings: dict[str, dict[str, list[int]]] = {field: {} for field in FILTER_FIELDS}
+        # Liste di righe già convertite in array, per (campo, valore)
+        self._posting_arrays: dict[tuple[str, str], np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def chunk_ids(self) -> np.ndarray:
+        """chunk_id delle righe indicizzate."""
+        return self._chunk_ids[: self._size]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Vettori indicizzati, una riga per chunk (vista sul buffer)."""
+        return self._matrix[: self._size]
+
+    @property
+    def alive(self) -> np.ndarray:
+        """Maschera delle righe non cancellate (vista sul buffer, modificabile)."""
+        return self._alive[: self._size]
+
+    @property
+    def dim(self) -> int:
+        """Dimensione dei vettori indicizzati."""
+        return self._matrix.shape[1]
+
+    @property
+    def truncated(self) -> bool:
+        """True se l'indice memorizza solo un prefisso degli embedding."""
+        return self.dim < self.input_dim
+
+    @property
+    def memory_bytes(self) -> int:
+        """Byte occupati dai vettori indicizzati (inclusa la capacità libera del buffer)."""
+        return self._matrix.nbytes
+
+    @property
+    def n_deleted(self) -> int:
+        """Numero di righe cancellate (tombstone) ancora presenti nella matrice."""
+        return int(len(self.alive) - np.count_nonzero(self.alive))
+
+    @property
+    def trained_rows(self) -> int:
+        """
+        Righe su cui sono stati calcolati i parametri che dipendono dai dati (scala
+        int8), fissati al build e non aggiornati da add; 0 se l'indice non ne ha.
+        """
+        return self.built_rows if self.quantization == "int8" else 0
+
+    def build(
+        self,
+        chunk_ids: Iterable[str],
+        embeddings: Iterable[Iterable[float]],
+        attributes: Optional[Iterable[dict]] = None,
+    ):
+        """
+        Costruisce l'indice a partire da chunk_id ed embedding.
+
+        Args:
+            chunk_ids: Identificativi dei chunk
+            embeddings: Embedding corrispondenti (stessa lunghezza)
+            attributes: Valori filtrabili per chunk (es. {"source": ..., "type": ...})
+        """
+        chunk_ids = list(chunk_ids)
+        vectors = _as_matrix(embeddings)
+
+        if vectors.ndim != 2 or len(chunk_ids) != vectors.shape[0]:
+            raise ValueError("chunk_ids ed embeddings devono avere la stessa lunghezza.")
+
+        self.input_dim = vectors.shape[1]
+        vectors = self._truncate(vectors)
+        if self.quantization == "int8":
+            scale = np.abs(vectors).max(axis=0) / 127.0
+            scale[scale == 0] = 1.0
+            self.scale = scale.astype(np.float32)
+
+        self._chunk_ids = np.array(chunk_ids, dtype=object)
+        self._matrix = self._encode(vectors)
+        self._alive = np.ones(len(chunk_ids), dtype=bool)
+        self._size = len(chunk_ids)
+        self.built_rows = len(chunk_ids)
+
+        self.postings = {field: {} for field in FILTER_FIELDS}
+        self._posting_arrays = {}
+        self._add_postings(0, attributes)
+
+    def add(
+        self,
+        chunk_ids: Iterable[str],
+        embeddings: Iterable[Iterable[float]],
+        attributes: Optional[Iterable[dict]] = None,
+    ):
+        """
+        Aggiunge nuovi vettori all'indice.
+
+        Args:
+            chunk_ids: Identificativi dei chunk
+            embeddings: Embedding corrispondenti
+            attributes: Valori filtrabili per chunk (es. {"source": ..., "type": ...})
+        """
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return
+        if len(self) == 0:
+            self.build(chunk_ids, embeddings, attributes)
+            return
+
+        vectors = _as_matrix(embeddings)
+        if vectors.shape != (len(chunk_ids), self.input_dim):
+            raise ValueError("chunk_ids ed embeddings non compatibili con l'indice.")
+        vectors = self._truncate(vectors)
+
+        offset = len(self)
+        self._reserve(offset + len(chunk_ids))
+        self._matrix[offset : offset + len(chunk_ids)] = self._encode(vectors)
+        self._chunk_ids[offset : offset + len(chunk_ids)] = chunk_ids
+        self._alive[offset : offset + len(chunk_ids)] = True
+        self._size = offset + len(chunk_ids)
+        self._add_postings(offset, attributes)
+
+    def _reserve(self, rows: int):
+        """Garantisce capacità per rows righe, raddoppiando i buffer quando serve."""
+        capacity = len(self._matrix)
+        if rows <= capacity:
+            return
+        capacity = max(rows, 2 * capacity)
+
+        matrix = np.empty((capacity, self._matrix.shape[1]), dtype=self._matrix.dtype)
+        matrix[: self._size] = self.matrix
+        chunk_ids = np.empty(capacity, dtype=object)
+        chunk_ids[: self._size] = self.chunk_ids
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: self._size] = self.alive
+        self._matrix, self._chunk_ids, self._alive = matrix, chunk_ids, alive
+
+    def remove(self, chunk_ids: Iterable[str]) -> int:
+        """
+        Marca come cancellati i chunk indicati (tombstone): non verranno più restituiti.
+
+        Args:
+            chunk_ids: Identificativi dei chunk da rimuovere
+
+        Returns:
+            Numero di righe rimosse
+        """
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids or len(self) == 0:
+            return 0
+
+        removed = np.isin(self.chunk_ids, chunk_ids) & self.alive
+        self.alive[removed] = False
+        return int(np.count_nonzero(removed))
+
+    def contains(self, chunk_ids: Iterable[str]) -> np.ndarray:
+        """Maschera booleana: True per i chunk_id già presenti (e non cancellati) nell'indice."""
+        chunk_ids = list(chunk_ids)
+        if len(self) == 0:
+            return np.zeros(len(chunk_ids), dtype=bool)
+        return np.isin(chunk_ids, self.chunk_ids[self.alive])
+
+    def filter_rows(self, filters: Optional[dict]) -> Optional[np.ndarray]:
+        """
+        Calcola le righe che soddisfano i filtri, senza toccare i vettori.
+
+        Args:
+            filters: Dizionario con chiavi opzionali "source", "type", "path" (valore
+                o lista di valori; una fonte che è un file include anche i suoi record
+                "fonte#riga") e "path_prefix" (prefisso del percorso del file)
+
+        Returns:
+            Array ordinato di righe, oppure None se non ci sono filtri
+        """
+        if not filters:
+            return None
+
+        unknown = set(filters) - {*FILTER_FIELDS, "path_prefix"}
+        if unknown:
+            raise ValueError(f"Filtri non supportati: {', '.join(sorted(unknown))}")
+
+        selections = []
+        for field in FILTER_FIELDS:
+            values = filters.get(field)
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            if field == "source":
+                # Una fonte che è un file (anche di record) si risolve con le liste per file,
+                # che includono le righe dei suoi record; le altre sono record singoli
+                files = [value for value in values if value in self.postings["path"]]
+                records = [value for value in values if value not in self.postings["path"]]
+                rows = _union([self._rows_for("path", files), self._rows_for("source", records)])
+            else:
+                rows = self._rows_for(field, values)
+            selections.append(rows)
+
+        prefix = filters.get("path_prefix")
+        if prefix:
+            # Scansione delle chiavi per file (non per record)
+            paths = [path for path in self.postings["path"] if path.startswith(prefix)]
+            selections.append(self._rows_for("path", paths))
+
+        if not selections:
+            return None
+
+        rows = selections[0]
+        for selection in selections[1:]:
+            rows = np.intersect1d(rows, selection, assume_unique=True)
+        return rows
+
+    def search(
+        self,
+        query_embedding: Iterable[float],
+        k: int = 5,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Optional[dict] = None,
+    ) -> list[tuple[str, float]]:
+        """
+        Cerca i k vettori più simili alla query (similarità coseno).
+
+        Args:
+            query_embedding: Embedding della query
+            k: Numero di risultati da restituire
+            nprobe: Ignorato dall'indice esatto
+            exact: Ignorato dall'indice esatto (la ricerca è sempre esaustiva)
+            filters: Filtri applicati prima dello scoring (vedi filter_rows)
+
+        Returns:
+            Lista di tuple (chunk_id, score) ordinate per score decrescente
+        """
+        if len(self) == 0:
+            return []
+
+        query = self._prepare_query(query_embedding)
+        return self._scan(query, self.filter_rows(filters), k)
+
+    def search_batch(
+        self,
+        query_embeddings: Iterable[Iterable[float]],
+        k: int = 5,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Optional[dict] = None,
+    ) -> list[list[tuple[str, float]]]:
+        """
+        Cerca i k vettori più simili per più query con un prodotto matrice-matrice.
+
+        Args:
+            query_embeddings: Embedding delle query
+            k: Numero di risultati per query
+            nprobe: Ignorato dall'indice esatto
+            exact: Ignorato dall'indice esatto (la ricerca è sempre esaustiva)
+            filters: Filtri applicati prima dello scoring, comuni a tutte le query
+
+        Returns:
+            Una lista di tuple (chunk_id, score) per ogni query, nello stesso ordine
+        """
+        query_embeddings = list(query_embeddings)
+        if len(self) == 0:
+            return [[] for _ in query_embeddings]
+
+        queries = self._prepare_queries(query_embeddings)
+        return self._scan_batch(queries, self.filter_rows(filters), k)
+
+    def vectors(self, rows) -> np.ndarray:
+        """Restituisce i vettori (decodificati in float32) delle righe indicate."""
+        block = self.matrix[rows]
+        if self.scale is None:
+            return block
+        return block.astype(np.float32) * self.scale
+
+    def _rows_for(self, field: str, values: Iterable[str]) -> np.ndarray:
+        """Unione ordinata delle righe che hanno uno dei valori indicati per il campo."""
+        postings = self.postings[field]
+        parts = []
+        for value in values:
+            if value not in postings:
+                continue
+            array = self._posting_arrays.get((field, value))
+            if array is None:
+                array = self._posting_arrays[(field, value)] = np.asarray(postings[value], dtype=np.int64)
+            parts.append(array)
+        return _union(parts)
+
+    def _add_postings(self, offset: int, attributes: Optional[Iterable[dict]]):
+        """Registra i valori filtrabili delle righe a partire da offset."""
+        if attributes is None:
+            return
+        for row, attrs in enumerate(attributes, start=offset):
+            for field in FILTER_FIELDS:
+                value = attrs.get(field)
+                if value is not None:
+                    self.postings[field].setdefault(value, []).append(row)
+                    self._posting_arrays.pop((field, value), None)
+
+    def _scan(self, query: np.ndarray, rows: Optional[np.ndarray], k: int) -> list[tuple[str, float]]:
+        """Ricerca esaustiva sulle righe indicate (tutte se rows è None)."""
+        if rows is None:
+            return self._select(query, np.arange(len(self)), self._score(query), k)
+        return self._select(query, rows, self._score(query, rows), k)
+
+    def _scan_batch(self, queries: np.ndarray, rows: Optional[np.ndarray], k: int) -> list[list[tuple[str, float]]]:
+        """Ricerca esaustiva di più query, a gruppi per limitare la matrice degli score."""
+        all_rows = np.arange(len(self)) if rows is None else rows
+        group = max(1, _BATCH_SCORE_ELEMENTS // max(len(all_rows), 1))
+
+        results = []
+        for start in range(0, len(queries), group):
+            block = queries[start : start + group]
+            scores = self._score(block.T, rows)
+            for j, query in enumerate(block):
+                results.append(self._select(query, all_rows, scores[:, j], k))
+        return results
+
+    def _truncate(self, vectors: np.ndarray) -> np.ndarray:
+        """Prefisso rinormalizzato delle righe (vettori completi normalizzati se prefix_dim è 0)."""
+        if 0 < self.prefix_dim < vectors.shape[1]:
+            vectors = vectors[:, : self.prefix_dim]
+        return normalize_rows(vectors)
+
+    def _first_pass(self, query: np.ndarray) -> np.ndarray:
+        """Query (vettore o matrice dim × n_query) ridotta al prefisso indicizzato e rinormalizzata."""
+        if not self.truncated:
+            return query
+        prefix = query[: self.dim]
+        norms = np.linalg.norm(prefix, axis=0, keepdims=True)
+        norms[norms == 0] = 1.0
+        return prefix / norms
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Converte vettori normalizzati nel formato di memorizzazione dell'indice."""
+        if self.scale is None:
+            return np.ascontiguousarray(vectors, dtype=np.float32)
+        codes = np.clip(np.rint(vectors / self.scale), -127, 127)
+        return np.ascontiguousarray(codes, dtype=np.int8)
+
+    def _score(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Calcola gli score (approssimati se quantizzati) contro le righe indicate.
+
+        query può essere un vettore (input_dim,) oppure una matrice (input_dim, n_query).
+        """
+        if rows is not None and len(rows) > _DENSE_FILTER_FRACTION * len(self):
+            # Filtro poco selettivo: il prodotto su tutta la matrice costa meno dell'estrazione delle righe
+            return self._score(query)[rows]
+
+        query = self._first_pass(query)
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if self.scale is None:
+            return matrix @ query
+
+        # Prodotto sui codici int8, convertiti a blocchi per non duplicare la matrice
+        scale = self.scale.reshape((-1,) + (1,) * (query.ndim - 1))
+        scaled_query = query * scale
+        scores = np.empty((len(matrix),) + query.shape[1:], dtype=np.float32)
+        for start in range(0, len(matrix), _BLOCK_ROWS):
+            block = matrix[start : start + _BLOCK_ROWS]
+            scores[start : start + len(block)] = block.astype(np.float32) @ scaled_query
+        return scores
+
+    def _select(self, query: np.ndarray, rows: np.ndarray, scores: np.ndarray, k: int) -> list[tuple[str, float]]:
+        """Sceglie i top-k tra le righe valutate, con rescoring a precisione piena se quantizzato o troncato."""
+        if self.n_deleted:
+            scores = np.where(self.alive[rows], scores, -np.inf)
+
+        if (self.scale is None and not self.truncated) or self.vector_loader is None:
+            top = top_k_indices(scores, k)
+            return [(self.chunk_ids[rows[i]], float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+        shortlist = top_k_indices(scores, max(k, self.rescore))
+        shortlist = rows[shortlist[np.isfinite(scores[shortlist])]]
+        candidate_ids = [self.chunk_ids[i] for i in shortlist]
+        full_vectors = self.vector_loader(candidate_ids)
+
+        candidate_ids = [chunk_id for chunk_id in candidate_ids if chunk_id in full_vectors]
+        if not candidate_ids:
+            return []
+
+        matrix = normalize_rows(np.asarray([full_vectors[c] for c in candidate_ids], dtype=np.float32))
+        exact_scores = matrix @ query
+        top = top_k_indices(exact_scores, k)
+        return [(candidate_ids[i], float(exact_scores[i])) for i in top]
+
+    def _prepare_query(self, query_embedding: Iterable[float]) -> np.ndarray:
+        """Converte la query in un vettore float32 normalizzato."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape != (self.input_dim,):
+            raise ValueError(f"Dimensione della query ({query.shape[-1]}) diversa da quella dell'indice ({self.input_dim}).")
+
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
+
+    def _prepare_queries(self, query_embeddings: Iterable[Iterable[float]]) -> np.ndarray:
+        """Converte più query in una matrice float32 (una riga per query) normalizzata."""
+        queries = np.asarray(list(query_embeddings), dtype=np.float32)
+        if queries.size == 0:
+            return np.empty((0, self.input_dim), dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.input_dim:
+            raise ValueError(f"Dimensione delle query diversa da quella dell'indice ({self.input_dim}).")
+        return normalize_rows(queries)
+
+
+class IVFIndex(VectorIndex):
+    """
+    Indice approssimato IVF: i vettori sono raggruppati attorno a centroidi
+    (k-means sferico) e la ricerca esamina solo le nprobe liste più vicine.
+    """
+
+    def __init__(
+        self,
+        n_lists: int = DEFAULT_IVF_LISTS,
+        nprobe: int = DEFAULT_NPROBE,
+        n_iter: int = 10,
+        **kwargs,
+    ):
+        """
+        Inizializza un indice IVF vuoto.
+
+        Args:
+            n_lists: Numero di liste/centroidi (0 = automatico, circa sqrt(N))
+            nprobe: Liste esaminate per query (più alto = recall migliore, più lento)
+            n_iter: Iterazioni di k-means in fase di build
+            **kwargs: Parametri di VectorIndex (quantization, rescore, vector_loader, prefix_dim)
+        """
+        super().__init__(**kwargs)
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        self.lists: list[np.ndarray] = []
+
+    @property
+    def memory_bytes(self) -> int:
+        """Byte occupati da vettori, centroidi e liste invertite."""
+        return super().memory_bytes + self.centroids.nbytes + sum(lst.nbytes for lst in self.lists)
+
+    @property
+    def trained_rows(self) -> int:
+        """Righe su cui sono stati addestrati i centroidi (e la scala int8)."""
+        return self.built_rows
+
+    def build(
+        self,
+        chunk_ids: Iterable[str],
+        embeddings: Iterable[Iterable[float]],
+        attributes: Optional[Iterable[dict]] = None,
+    ):
+        """Costruisce l'indice: addestra i centroidi e assegna ogni vettore a una lista."""
+        super().build(chunk_ids, embeddings, attributes)
+
+        n_lists = self.n_lists or int(math.sqrt(len(self)))
+        n_lists = max(1, min(n_lists, len(self)))
+
+        self.centroids = self._train_centroids(n_lists)
+        empty_lists = [np.empty(0, dtype=np.int64) for _ in range(n_lists)]
+        self.lists = self._group(self._assign(0, len(self)), offset=0, lists=empty_lists)
+
+    def add(
+        self,
+        chunk_ids: Iterable[str],
+        embeddings: Iterable[Iterable[float]],
+        attributes: Optional[Iterable[dict]] = None,
+    ):
+        """Aggiunge vettori assegnandoli ai centroidi esistenti (senza riaddestrare)."""
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return
+        if len(self) == 0:
+            self.build(chunk_ids, embeddings, attributes)
+            return
+
+        offset = len(self)
+        super().add(chunk_ids, embeddings, attributes)
+        self.lists = self._group(self._assign(offset, len(self)), offset=offset, lists=self.lists)
+
+    def search(
+        self,
+        query_embedding: Iterable[float],
+        k: int = 5,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Optional[dict] = None,
+    ) -> list[tuple[str, float]]:
+        """
+        Cerca i k vettori più simili esaminando le nprobe liste più vicine alla query.
+
+        Con filtri selettivi (meno righe di quante ne esaminerebbe la ricerca IVF)
+        il sottoinsieme filtrato viene scansionato per intero.
+
+        Args:
+            query_embedding: Embedding della query
+            k: Numero di risultati da restituire
+            nprobe: Liste da esaminare (default: self.nprobe)
+            exact: Se True, esegue la ricerca esaustiva su tutti i vettori
+            filters: Filtri applicati prima dello scoring (vedi filter_rows)
+
+        Returns:
+            Lista di tuple (chunk_id, score) ordinate per score decrescente
+        """
+        if len(self) == 0:
+            return []
+
+        nprobe = nprobe or self.nprobe
+        query = self._prepare_query(query_embedding)
+        rows = self.filter_rows(filters)
+
+        selective = rows is not None and len(rows) <= len(self) * nprobe / len(self.lists)
+        if exact or selective or nprobe >= len(self.lists):
+            return self._scan(query, rows, k)
+
+        probe = top_k_indices(self.centroids @ self._first_pass(query), nprobe)
+        candidates = np.concatenate([self.lists[c] for c in probe])
+        if rows is not None:
+            candidates = candidates[np.isin(candidates, rows, assume_unique=True)]
+
+        return self._select(query, candidates, self._score(query, candidates), k)
+
+    def search_batch(
+        self,
+        query_embeddings: Iterable[Iterable[float]],
+        k: int = 5,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        filters: Optional[dict] = None,
+    ) -> list[list[tuple[str, float]]]:
+        """
+        Ricerca di più query: esaustiva in un unico prodotto matrice-matrice se
+        exact (o nprobe copre tutte le liste), altrimenti una ricerca IVF per query.
+        """
+        nprobe = nprobe or self.nprobe
+        if exact or nprobe >= len(self.lists):
+            return super().search_batch(query_embeddings, k, filters=filters)
+        return [self.search(query, k, nprobe=nprobe, filters=filters) for query in query_embeddings]
+
+    def _train_centroids(self, n_lists: int) -> np.ndarray:
+        """K-means sferico su un campione dei vettori."""
+        rng = np.random.default_rng(0)
+        sample_size = min(len(self), max(n_lists * 256, 10000))
+        sample = self.vectors(np.sort(rng.choice(len(self), size=sample_size, replace=False)))
+
+        centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+
+            # Le liste rimaste vuote vengono reinizializzate su punti casuali
+            empty = np.bincount(assignments, minlength=n_lists) == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            centroids = normalize_rows(sums).astype(np.float32)
+
+        return centroids
+
+    def _assign(self, start: int, stop: int) -> np.ndarray:
+        """Assegna le righe [start, stop) al centroide più vicino, a blocchi."""
+        assignments = np.empty(stop - start, dtype=np.int64)
+        for block_start in range(start, stop, _BLOCK_ROWS):
+            block_stop = min(block_start + _BLOCK_ROWS, stop)
+            block = self.vectors(slice(block_start, block_stop))
+            assignments[block_start - start : block_stop - start] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    @staticmethod
+    def _group(assignments: np.ndarray, offset: int, lists: list[np.ndarray]) -> list[np.ndarray]:
+        """Aggiunge alle liste invertite le righe (offset + i) secondo la loro assegnazione."""
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=len(lists))
+        groups = np.split(order + offset, np.cumsum(counts)[:-1])
+        return [np.concatenate([lst, grp]) if grp.size else lst for lst, grp in zip(lists, groups)]
+
+
+def create_vector_index(index_type: str = DEFAULT_INDEX_TYPE, **kwargs) -> VectorIndex:
+    """
+    Crea un indice vettoriale del tipo richiesto.
+
+    Args:
+        index_type: "exact" (brute force) oppure "ivf" (approssimato)
+        **kwargs: Parametri specifici dell'indice (es. n_lists, nprobe, quantization)
+
+    Returns:
+        Indice vuoto
+    """
+    if index_type == "exact":
+        return VectorIndex(**kwargs)
+    if index_type == "ivf":
+        return IVFIndex(**kwargs)
+    raise ValueError(f"Tipo di indice non supportato: {index_type}")
+
+
+def evaluate_recall(
+    index: VectorIndex,
+    reference: VectorIndex,
+    queries: np.ndarray,
+    k: int = 10,
+    **search_kwargs,
+) -> dict:
+    """
+    Misura recall@k e latenza di un indice rispetto a un indice esatto di riferimento.
+
+    Args:
+        index: Indice da valutare
+        reference: Indice esatto (float32) sugli stessi vettori
+        queries: Matrice di query (una per riga)
+        k: Numero di risultati per query
+        **search_kwargs: Parametri di ricerca (es. nprobe)
+
+    Returns:
+        Dizionario con recall@k, latenze medie (ms) e memoria dei due indici
+    """
+    hits = 0
+    index_time = 0.0
+    reference_time = 0.0
+
+    for query in queries:
+        start = time.perf_counter()
+        expected = {chunk_id for chunk_id, _ in reference.search(query, k)}
+        reference_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = {chunk_id for chunk_id, _ in index.search(query, k, **search_kwargs)}
+        index_time += time.perf_counter() - start
+
+        hits += len(expected & found)
+
+    n_queries = max(len(queries), 1)
+    return {
+        "recall_at_k": hits / max(k * len(queries), 1),
+        "k": k,
+        "queries": len(queries),
+        "latency_ms": 1000 * index_time / n_queries,
+        "reference_latency_ms": 1000 * reference_time / n_queries,
+        "dim": index.dim,
+        "input_dim": index.input_dim,
+        "memory_bytes": index.memory_bytes,
+        "reference_memory_bytes": reference.memory_bytes,
+    }